@@ -5,12 +5,22 @@
 # UPDATED: Duplicate detection now only considers 'Approved' and 'On Hold' records
 # ================================
 
+from collections import namedtuple
 from datetime import date
+import os
 import pandas as pd
 import numpy as np
 import streamlit as st
-import requests
-from io import BytesIO, StringIO
+
+from kobo_data import SNAPSHOT_DIR, SnapshotStore, asset_api_base, shared_refresher, shared_sync
+from qc_engine import (
+    ACTIVE_RULES, CUBE_DATE, QC_RULES, VALIDATION_COL, ChildIndex, CrossClusterIndex, DailyTrend, FilterOptions, QCState,
+    RowIndex, build_aggregate_cube, build_duplicate_indexes, cube_coverage_scorecard, normalize_mortality,
+    parse_sop_map, parse_target_plan, render_qc_issues, resolve_schema, slice_cube, trend_contributions,
+)
+
+# Snapshot frames are shared by every session; copy-on-write keeps views of them read-only
+pd.options.mode.copy_on_write = True
 
 # ---------------- SESSION STATE INITIALIZATION ----------------
 if 'usage_count' not in st.session_state:
@@ -78,6 +88,12 @@ MAIN_SHEET = "mortality_pilot_cluster_one-..."
 FEMALES_SHEET = "female"
 PREG_SHEET = "pregnancy_history"
 
+# Other clusters' exports (same form layout), checked for households/mothers/children submitted in both
+CLUSTER_NAME = "Cluster 1"
+PEER_CLUSTERS = {
+    "Cluster 2": ("https://kf.kobotoolbox.org/api/v2/assets/aMaahuu5VANkY6o4QyQ8uC/export-settings/eskrSsschnVuLb8uHgnAkTR/data.xlsx", "mortality_pilot_cluster_two-..."),
+}
+
 
 # --- AUTHENTICATION LOGIC ---
 ADMIN_USER = 'Admin'
@@ -191,15 +207,13 @@ Potiskum	Yerimaram	Nahuta_Pri_School	B-11_14_10_8
 Potiskum	Yerimaram	Mai_Anguwa_Yakubu_33	B-11_14_10_9
 Potiskum	Yerimaram	Mai_Anguwa_Sale	B-11_14_10_10
 """
-try:
-    SOP_DF = pd.read_csv(StringIO(SOP_DATA), sep='\t', skipinitialspace=True)
-    EXPECTED_SOP_COLUMNS = ['lga_Label', 'ward_Label', 'settlement_Label', 'Community_ID']
-    if list(SOP_DF.columns) == EXPECTED_SOP_COLUMNS:
-        SOP_COMMUNITY_MAP = SOP_DF.set_index('Community_ID')['settlement_Label'].to_dict()
-    else:
-        SOP_COMMUNITY_MAP = {}
-except Exception:
-    SOP_COMMUNITY_MAP = {}
+
+@st.cache_resource(show_spinner=False)
+def get_sop_map(sop_data):
+    """SOP code -> settlement map, parsed once per process instead of on every rerun."""
+    return parse_sop_map(sop_data)
+
+SOP_COMMUNITY_MAP = get_sop_map(SOP_DATA)
 
 # --- Community Target Plan Data ---
 TARGET_PLAN_DATA = """
@@ -305,14 +319,13 @@ Potiskum	Yerimaram	Nahuta_Pri_School	B-11_14_10_8	307
 Potiskum	Yerimaram	Mai_Anguwa_Yakubu_33	B-11_14_10_9	148
 Potiskum	Yerimaram	Mai_Anguwa_Sale	B-11_14_10_10	36
 """
-try:
-    TARGET_PLAN_DF = pd.read_csv(StringIO(TARGET_PLAN_DATA), sep='\t', skipinitialspace=True)
-    TARGET_PLAN_DF.columns = TARGET_PLAN_DF.columns.str.strip()
-    if 'Settlement Planned' in TARGET_PLAN_DF.columns:
-        TARGET_PLAN_DF.rename(columns={'Settlement Planned': 'Target_Plan'}, inplace=True)
-    TARGET_PLAN_DF['Target_Plan'] = pd.to_numeric(TARGET_PLAN_DF['Target_Plan'], errors='coerce').fillna(0).astype(int)
-except Exception:
-    TARGET_PLAN_DF = pd.DataFrame()
+
+@st.cache_resource(show_spinner=False)
+def get_target_plan(target_plan_data):
+    """Target plan table, parsed once per process instead of on every rerun (shared: treat as read-only)."""
+    return parse_target_plan(target_plan_data)
+
+TARGET_PLAN_DF = get_target_plan(TARGET_PLAN_DATA)
 
 
 # ---------------- LOGIN PAGE FUNCTIONS ----------------
@@ -353,180 +366,329 @@ def show_login_page():
 
 
 # ---------------- DATA LOADER ----------------
-@st.cache_data(show_spinner="Downloading and processing latest KoboToolbox data...", ttl=600)
+def get_kobo_sync():
+    """Process-wide sync state: keeps the last downloaded frames so refreshes only pull new/re-validated submissions.
+    Shared by every session, so a cache miss in several sessions at once still runs a single download."""
+    return shared_sync(DATA_URL, MAIN_SHEET, FEMALES_SHEET, PREG_SHEET)
+
+
+TREND_FRAMES = ("contributions", "daily")
+
+# One prepared data version, shared read-only by every session
+Dataset = namedtuple(
+    "Dataset", ["df_mortality", "df_females", "df_preg", "ward_rows", "qc_state", "trend", "child_rows", "schema"]
+)
+
+
+def prepare_data(frames, previous=None, changed=None):
+    """Load-time processing, run by the refresher thread before a new snapshot is published.
+
+    Returns a Dataset (df_mortality, df_females, df_preg, ward_rows, qc_state, trend, child_rows, schema) where every ward's
+    rows are one contiguous block in each frame, ward_rows maps ward -> (mortality, female, pregnancy) row slices,
+    qc_state holds the QC results (rolled forward from `previous` when only `changed` submissions moved),
+    trend is the DailyTrend, rolled forward from `previous` (or the copy stored with the snapshot on a cold start)
+    for the submissions whose day totals moved, and
+    child_rows is the (female, pregnancy) ChildIndex: submission -> its contiguous rows in that sheet, and
+    schema maps each logical field (ward, ra, unique_code, ...) to its column, resolved once for the version.
+    """
+    df_mortality, df_females, df_preg = frames
+    schema = resolve_schema(df_mortality, df_females, df_preg)
+    # The sync state keeps the raw frames; normalise a private copy
+    df_mortality = normalize_mortality(df_mortality, SOP_COMMUNITY_MAP)
+
+    # Group every frame by ward once, so a ward login slices zero-copy views instead of filtering copies.
+    # Child rows follow their submission's row, so each submission's children are contiguous too.
+    ward_rows = {}
+    child_rows = (ChildIndex([]), ChildIndex([]))
+    WARD_COL = schema['ward']
+    if '_uuid' in df_mortality.columns:
+        if WARD_COL:
+            df_mortality = df_mortality.sort_values(WARD_COL, kind="stable", na_position="last").reset_index(drop=True)
+        row_of_submission = pd.Series(np.arange(len(df_mortality)), index=df_mortality['_uuid'].to_numpy())
+        row_of_submission = row_of_submission[~row_of_submission.index.duplicated()]
+        child_frames = []
+        for df_child in (df_females, df_preg):
+            if '_submission__uuid' in df_child.columns:
+                df_child = df_child.assign(_parent_row=df_child['_submission__uuid'].map(row_of_submission)).sort_values(
+                    ["_parent_row", "_submission__uuid"], kind="stable", na_position="last"
+                ).drop(columns="_parent_row").reset_index(drop=True)
+            child_frames.append(df_child)
+        df_females, df_preg = child_frames
+        child_rows = tuple(
+            ChildIndex(df_child['_submission__uuid'] if '_submission__uuid' in df_child.columns else [])
+            for df_child in child_frames
+        )
+
+    if WARD_COL and '_uuid' in df_mortality.columns:
+        ward_of_submission = dict(zip(df_mortality['_uuid'], df_mortality[WARD_COL]))
+        ward_keys = [df_mortality[WARD_COL]]
+        for df_child in (df_females, df_preg):
+            if '_submission__uuid' in df_child.columns:
+                ward_keys.append(df_child['_submission__uuid'].map(ward_of_submission))
+            else:
+                ward_keys.append(pd.Series(np.nan, index=df_child.index))
+
+        def row_ranges(keys):
+            return {k: slice(rows.min(), rows.max() + 1) for k, rows in keys.groupby(keys, observed=True).indices.items()}
+
+        mortality_rows, female_rows, preg_rows = (row_ranges(keys) for keys in ward_keys)
+        empty = slice(0, 0)
+        ward_rows = {
+            ward: (rows, female_rows.get(ward, empty), preg_rows.get(ward, empty))
+            for ward, rows in mortality_rows.items()
+        }
+
+    if previous is not None and changed is not None:
+        qc_state = previous.qc_state.updated(df_mortality, df_females, df_preg, changed, child_rows)
+    else:
+        qc_state = QCState.build(df_mortality, df_females, df_preg, child_rows)
+
+    trend_dims = [schema[field] for field in ("ward", "lga", "community", "ra")]
+    contributions = trend_contributions(
+        df_mortality, qc_state.table(), [col for col in trend_dims if col], "start", qc_state.ward_table()
+    )
+    sync = get_kobo_sync()
+    if previous is not None:
+        trend = previous.trend
+    else:
+        stored = sync.load_derived("trend", TREND_FRAMES)
+        trend = DailyTrend.from_frames(*stored) if stored is not None else None
+    trend = trend.updated(contributions) if trend is not None else DailyTrend.build(contributions)
+    sync.save_derived("trend", TREND_FRAMES, trend.to_frames())
+
+    return Dataset(df_mortality, df_females, df_preg, ward_rows, qc_state, trend, child_rows, schema)
+
+
+def get_data_refresher():
+    """Background refresher (stale-while-revalidate): re-syncs every 10 minutes and swaps in the new snapshot."""
+    return shared_refresher(get_kobo_sync(), prepare=prepare_data)
+
+
+def get_peer_store(cluster):
+    """The snapshot another cluster's dashboard publishes; read-only here, so no second download of its export."""
+    data_url, main_sheet = PEER_CLUSTERS[cluster]
+    asset_uid = asset_api_base(data_url).rsplit("/", 1)[-1]
+    return SnapshotStore(os.path.join(SNAPSHOT_DIR, asset_uid), (main_sheet, FEMALES_SHEET, PREG_SHEET))
+
+
+def get_peer_version(cluster):
+    """Version id of the peer's published sheets (its data directory), or None before its first sync."""
+    manifest = get_peer_store(cluster).manifest()
+    return manifest.get("data_dir", "") if manifest else None
+
+
+@st.cache_resource(max_entries=4, show_spinner=False)
+def get_peer_indexes(cluster, peer_version):
+    """Duplicate indexes of a peer cluster's published snapshot, built once per peer version."""
+    frames, _ = get_peer_store(cluster).load()
+    return build_duplicate_indexes(*frames) if frames is not None else None
+
+
 def load_data(force_refresh=False):
-    """Load the latest data from the server."""
+    """Return the version id of the last good snapshot (instantly); Force Refresh only wakes the background refresher."""
+    refresher = get_data_refresher()
     if force_refresh:
-        st.cache_data.clear()
+        refresher.trigger()
+
+    snapshot = refresher.snapshot
+    if snapshot is None:
+        # Cold start with no snapshot on disk yet: the first download has to be waited for
+        with st.spinner("Downloading and processing latest KoboToolbox data..."):
+            snapshot = refresher.latest()
 
-    try:
-        response = requests.get(DATA_URL, timeout=300)
-        response.raise_for_status()
-        excel_file = BytesIO(response.content)
-        data_dict = pd.read_excel(excel_file, sheet_name=None)
+    if snapshot is None:
+        st.error(f"❌ Error loading workbook: {refresher.last_error}")
+        return None
 
-        df_mortality = data_dict.get(MAIN_SHEET, pd.DataFrame())
-        df_females = data_dict.get(FEMALES_SHEET, pd.DataFrame())
-        df_preg = data_dict.get(PREG_SHEET, pd.DataFrame())
+    st.session_state.data_as_of = snapshot.as_of
+    st.session_state.data_refreshing = refresher.refreshing
+    return snapshot.version
 
-        if "start" in df_mortality.columns:
-            df_mortality["start"] = pd.to_datetime(df_mortality["start"], errors='coerce')
 
-        COMMUNITY_COL_RAW = find_column_with_suffix(df_mortality, "community")
-        
-        if COMMUNITY_COL_RAW in df_mortality.columns and SOP_COMMUNITY_MAP:
-             df_mortality[COMMUNITY_COL_RAW] = df_mortality[COMMUNITY_COL_RAW].astype(str).map(
-                 lambda x: SOP_COMMUNITY_MAP.get(x, x)
-             )
-            
+def get_dataset(data_version):
+    """Shared, read-only Dataset for a data version: one copy per process (empty, with qc_state None, once it is evicted)."""
+    snapshot = get_data_refresher().get(data_version) if data_version else None
+    if snapshot is None:
+        return Dataset(
+            pd.DataFrame(), pd.DataFrame(), pd.DataFrame(), {}, None, None, (ChildIndex([]), ChildIndex([])),
+            resolve_schema(None, None, None)
+        )
+    return snapshot.frames
+
+
+def get_ward_frames(data_version, ward=None):
+    """(df_mortality, df_females, df_preg) for one ward as zero-copy views of the shared frames (ward=None: all wards)."""
+    dataset = get_dataset(data_version)
+    df_mortality, df_females, df_preg, ward_rows = dataset.df_mortality, dataset.df_females, dataset.df_preg, dataset.ward_rows
+    if ward is None:
         return df_mortality, df_females, df_preg
+    # Each ward is a contiguous block of the shared frames, so these are views, not copies
+    empty = slice(0, 0)
+    mortality_rows, female_rows, preg_rows = ward_rows.get(ward, (empty, empty, empty))
+    return df_mortality.iloc[mortality_rows], df_females.iloc[female_rows], df_preg.iloc[preg_rows]
 
-    except Exception as e:
-        st.error(f"❌ Error loading workbook: {e}")
-        return pd.DataFrame(), pd.DataFrame(), pd.DataFrame()
 
 # ---------------- HELPER FUNCTIONS ----------------
-def find_column_with_suffix(df, keyword):
-    if df is None or df.empty:
-        return None
-    for col in df.columns:
-        if keyword.lower() in col.lower():
-            return col
-    return None
+@st.cache_resource(max_entries=32, show_spinner="Running QC checks...")
+def get_qc_table(data_version, ward=None):
+    """QC table for one data version and ward scope (None = all wards), computed once per process and shared.
 
-def generate_qc_dataframe(df_mortality, df_females, df_preg_history):
+    Assembled from the snapshot's QCState (duplicates are checked within the ward for ward logins).
+    Indexed by submission UUID so a filter change only slices rows out of it instead of re-running QC.
     """
-    Generate QC dataframe with error detection.
-    CRITICAL: Duplicate household detection now ONLY considers records that are 'Approved' or 'On Hold',
-    excluding 'Not Approved' records entirely from duplication logic.
+    qc_state = get_dataset(data_version).qc_state
+    if qc_state is None:
+        # Version no longer held: an empty table with the usual columns
+        qc_state = QCState.build(pd.DataFrame(), pd.DataFrame(), pd.DataFrame())
+    qc_df = qc_state.table(ward)
+    qc_df.index = qc_df['_submission__uuid'].to_numpy()
+    return qc_df
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_aggregate_cube(data_version, ward, dim_cols, date_col):
+    """Submission / QC flag counts per ward x LGA x community x RA x date x validation status.
+
+    Built once per data version and QC scope; every filter combination is then a slice-and-sum of it.
     """
-    # Dynamic column finding
-    outcome_col = find_column_with_suffix(df_preg_history, "Was the baby born alive")
-    still_alive_col = find_column_with_suffix(df_preg_history, "still alive")
-    boys_dead_col = find_column_with_suffix(df_females, "boys have died")
-    girls_dead_col = find_column_with_suffix(df_females, "daughters have died")
-    c_alive_col = find_column_with_suffix(df_females, "c_alive")
-    c_dead_col = find_column_with_suffix(df_females, "c_dead")
-    miscarriage_col = find_column_with_suffix(df_females, "misscarraige")
+    df_mortality, _, _ = get_ward_frames(data_version, ward)
+    return build_aggregate_cube(df_mortality, get_qc_table(data_version, ward), list(dim_cols), date_col)
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_filter_options(data_version, ward, dim_cols, date_col, levels):
+    """Cascading sidebar options for a data version and ward scope, read from its aggregate cube."""
+    return FilterOptions(get_aggregate_cube(data_version, ward, dim_cols, date_col), levels)
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_row_index(data_version, ward, cols, date_col):
+    """Row positions per filter value (and collection date) of a ward scope's main sheet, built once per data version."""
+    df_mortality, _, _ = get_ward_frames(data_version, ward)
+    return RowIndex(df_mortality, cols, date_col)
+
+# The per-section tables below are keyed by (data_version, ward scope, selection), the selection being the
+# sidebar filters as sorted (cube column, value) pairs, so a rerun with the same selection reuses them.
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_selection_rows(data_version, ward, cols, date_col, filters):
+    """Row positions of the selection in the ward scope's main sheet: (all rows, rows other than 'Not Approved')."""
+    row_index = get_row_index(data_version, ward, cols, date_col)
+    cube_filters = dict(filters)
+    return row_index.rows(cube_filters), row_index.rows(cube_filters, exclude={VALIDATION_COL: "Not Approved"})
+
+def get_filtered_frames(data_version, ward, cols, date_col, filters):
+    """(filtered_final, df_for_metrics): the selection's main-sheet rows, and the same without 'Not Approved'.
+
+    Gathered from the cached row positions on each call; only the section caches keep what they derive from them.
+    """
+    df_mortality, _, _ = get_ward_frames(data_version, ward)
+    rows, metric_rows = get_selection_rows(data_version, ward, cols, date_col, filters)
+    filtered_final = df_mortality.iloc[rows]
+    df_for_metrics = df_mortality.iloc[metric_rows]
+    if VALIDATION_COL in df_for_metrics.columns:
+        df_for_metrics[VALIDATION_COL] = df_for_metrics[VALIDATION_COL].astype(object).fillna("Validation Ongoing")
+    return filtered_final, df_for_metrics
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_trend_series(data_version, ward, filters):
+    """Per-day and cumulative trend of the selection (ward logins count duplicates within their ward)."""
+    trend = get_dataset(data_version).trend
+    return trend.series(dict(filters), ward_scope=ward is not None) if trend is not None else pd.DataFrame()
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_duplicate_households(data_version, ward, cols, date_col, filters, unique_code_col):
+    """The selection's Approved/On Hold submissions sharing a household code, sorted by code."""
+    # CRITICAL: Use df_for_metrics which already excludes "Not Approved"
+    _, df_for_metrics = get_filtered_frames(data_version, ward, cols, date_col, filters)
+    qc_state = get_dataset(data_version).qc_state
+    if qc_state is not None and qc_state.columns['unique_code_col'] == unique_code_col:
+        # Look the filtered households up in the maintained duplicate index instead of rescanning
+        household_index = qc_state.duplicate_indexes["Duplicate_Household"]
+        dupe_mask = df_for_metrics['_uuid'].isin(list(household_index.duplicates_among(df_for_metrics['_uuid'])))
+    else:
+        dupe_mask = df_for_metrics.duplicated(subset=unique_code_col, keep=False)
+    return df_for_metrics[dupe_mask].sort_values(by=unique_code_col)
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_metrics_cube(data_version, ward, dim_cols, date_col, filters):
+    """The aggregate cube sliced to the selection, without 'Not Approved' cells: the headline metrics' source."""
+    view_cube = slice_cube(get_aggregate_cube(data_version, ward, dim_cols, date_col), dict(filters))
+    if VALIDATION_COL in view_cube.columns:
+        return view_cube[view_cube[VALIDATION_COL] != "Not Approved"]
+    return view_cube
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_coverage_scorecard(data_version, ward, dim_cols, date_col, filters, ward_col, community_col):
+    """Community coverage scorecard (target plan vs. submissions) for the selection."""
+    return cube_coverage_scorecard(
+        get_aggregate_cube(data_version, ward, dim_cols, date_col),
+        get_metrics_cube(data_version, ward, dim_cols, date_col, filters),
+        TARGET_PLAN_DF,
+        ward_col,
+        community_col,
+        VALIDATION_COL
+    )
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_error_records(data_version, ward, cols, date_col, filters, merge_cols, ra_col, consent_date_col):
+    """The selection's flagged submissions with their QC issues, merged with their main-sheet `merge_cols`."""
+    _, df_for_metrics = get_filtered_frames(data_version, ward, cols, date_col, filters)
+    # QC data: computed once per data version and ward scope, then sliced for the selection
+    df_qc = get_qc_table(data_version, ward)
+    filtered_df = df_qc.loc[df_qc.index.intersection(df_for_metrics['_uuid'], sort=False)]
+
+    display_df = filtered_df[filtered_df['Total_Flags'] > 0].copy()
+    display_df['QC_Issues'] = render_qc_issues(display_df['QC_Flags'])
     
-    UNIQUE_CODE_COL = find_column_with_suffix(df_mortality, "unique_code") or 'unique_code_col_not_found'
-    VALIDATION_COL = '_validation_status'
+    present_dupe_cols = [col for col in merge_cols if col in df_for_metrics.columns]
+    dupe_df = df_for_metrics[present_dupe_cols].rename(columns={'_uuid': '_submission__uuid'}).copy()
     
-    # Handle missing columns in sub-tables by creating dummy columns
-    female_cols = {
-        'c_alive_col': c_alive_col, 'c_dead_col': c_dead_col, 'miscarriage_col': miscarriage_col,
-        'boys_dead_col': boys_dead_col, 'girls_dead_col': girls_dead_col
-    }
-    for name, col in female_cols.items():
-        if col is None or col not in df_females.columns:
-            dummy_col = f'_{name}_dummy'
-            df_females[dummy_col] = 0
-            female_cols[name] = dummy_col
-    c_alive_col, c_dead_col, miscarriage_col, boys_dead_col, girls_dead_col = female_cols.values()
-
-    # --- CRITICAL FIX: Household, Mother, and Child Duplicate Check ONLY for Approved/On Hold ---
-    # Filter out "Not Approved" records BEFORE checking for duplicates
-    if VALIDATION_COL in df_mortality.columns:
-        df_mortality_for_dupe_check = df_mortality[df_mortality[VALIDATION_COL] != "Not Approved"].copy()
-        # Get the list of approved/on-hold submission UUIDs
-        approved_uuids = df_mortality_for_dupe_check['_uuid'].unique()
-    else:
-        # If validation column doesn't exist, use all records
-        df_mortality_for_dupe_check = df_mortality.copy()
-        approved_uuids = df_mortality['_uuid'].unique()
+    if ra_col in dupe_df.columns:
+        dupe_df.rename(columns={ra_col: 'Research_Assistant_Merge'}, inplace=True)
+
+    if consent_date_col in dupe_df.columns and pd.api.types.is_datetime64_any_dtype(dupe_df[consent_date_col]):
+        dupe_df[consent_date_col] = dupe_df[consent_date_col].dt.strftime('%Y-%m-%d')
+        
+    display_df = display_df.merge(dupe_df, on="_submission__uuid", how="left")
+    return display_df.drop(columns=["Research_Assistant_Merge"], errors='ignore')
+
+@st.cache_resource(max_entries=32, show_spinner=False)
+def get_comment_records(data_version, ward, cols, date_col, filters, comment_col):
+    """The selection's Not Approved / On Hold submissions with a validation comment, from December 11, 2025 on."""
+    # Start with the original filtered data (respects ward filtering)
+    df_comments_base, _ = get_filtered_frames(data_version, ward, cols, date_col, filters)
     
-    # Check household duplicates (already filtered)
-    if UNIQUE_CODE_COL in df_mortality_for_dupe_check.columns:
-        mortality_dupes = df_mortality_for_dupe_check[df_mortality_for_dupe_check.duplicated(subset=UNIQUE_CODE_COL, keep=False)]
-    else:
-        mortality_dupes = pd.DataFrame()
+    # Filter 1: Only records with non-empty validation comments
+    df_with_comments = df_comments_base[
+        df_comments_base[comment_col].notna() & 
+        (df_comments_base[comment_col].astype(str).str.strip() != '')
+    ].copy()
     
-    # Filter females and pregnancy history to ONLY include approved/on-hold records
-    df_females_for_dupe_check = df_females[df_females['_submission__uuid'].isin(approved_uuids)]
-    df_preg_for_dupe_check = df_preg_history[df_preg_history['_submission__uuid'].isin(approved_uuids)]
+    # Filter 2: Exclude 'Approved' records - only show 'Not Approved' or 'On Hold'
+    if VALIDATION_COL in df_with_comments.columns:
+        df_with_comments = df_with_comments[
+            (df_with_comments[VALIDATION_COL] == "Not Approved") | 
+            (df_with_comments[VALIDATION_COL] == "On Hold")
+        ].copy()
     
-    # Check mother and child duplicates (now filtered to exclude "Not Approved")
-    females_dupes = df_females_for_dupe_check[df_females_for_dupe_check.duplicated(subset="mother_id", keep=False)]
-    preg_dupes = df_preg_for_dupe_check[df_preg_for_dupe_check.duplicated(subset="child_id", keep=False)]
+    # Filter 3: Only records from December 11, 2025 onwards
+    if date_col in df_with_comments.columns:
+        cutoff_date = pd.to_datetime('2025-12-11')
+        df_with_comments = df_with_comments[df_with_comments[date_col] >= cutoff_date].copy()
+    return df_with_comments
 
-    dupe_household_uuids = mortality_dupes['_uuid'].unique()
-    dupe_mother_uuids = females_dupes['_submission__uuid'].unique()
-    dupe_child_uuids = preg_dupes['_submission__uuid'].unique()
-        
-    # Aggregate female-level data
-    females_agg = df_females.groupby('_submission__uuid').agg({
-        c_alive_col: 'sum', c_dead_col: 'sum', miscarriage_col: 'sum',
-        boys_dead_col: 'sum', girls_dead_col: 'sum'
-    }).reset_index()
-    females_agg['total_children_died'] = females_agg[boys_dead_col].fillna(0) + females_agg[girls_dead_col].fillna(0)
-
-    # Aggregate pregnancy history data
-    preg = df_preg_history.copy()
-    if outcome_col not in preg.columns:
-        preg['_outcome_dummy'] = np.nan
-        outcome_col = '_outcome_dummy'
-    if still_alive_col not in preg.columns:
-        preg['_still_alive_dummy'] = np.nan
-        still_alive_col = '_still_alive_dummy'
-
-    def per_submission_agg(g):
-        born_alive_and_alive = ((g[outcome_col] == "Born Alive") & (g[still_alive_col] == "Yes")).sum()
-        later_died = (g[still_alive_col] == "No").sum()
-        miscarriage_count = ((g[outcome_col] == "Miscarriage and Abortion") | (g[outcome_col] == "Born dead")).sum()
-        born_dead_raw = (g[outcome_col] == "Born dead").sum()
-        return pd.Series({
-            "Born_Alive": int(born_alive_and_alive),
-            "Later_Died": int(later_died),
-            "Miscarriage_Abortion": int(miscarriage_count),
-            "Born_Dead_Raw": int(born_dead_raw)
-        })
-
-    preg_counts = preg.groupby('_submission__uuid').apply(per_submission_agg).reset_index()
-    merged = females_agg.merge(preg_counts, on="_submission__uuid", how="left").fillna(0)
-
-    qc_rows = []
-    for _, row in merged.iterrows():
-        errors = []
-        uuid = row['_submission__uuid']
-        
-        # Internal Consistency Errors
-        if c_alive_col and int(row[c_alive_col]) != int(row['Born_Alive']):
-            errors.append("Born Alive mismatch")
-        if miscarriage_col and int(row[miscarriage_col]) != int(row['Miscarriage_Abortion']):
-            errors.append("Miscarrage mismatch")
-        if c_dead_col and int(row[c_dead_col]) != int(row['Later_Died']):
-            errors.append("Born Alive but Later Died mismatch")
-            
-        # Duplication Errors (now ONLY includes Approved/On Hold duplicates)
-        if uuid in dupe_household_uuids:
-            errors.append("Duplicate Household")
-        if uuid in dupe_mother_uuids:
-            errors.append("Duplicate Mother")
-        if uuid in dupe_child_uuids:
-            errors.append("Duplicate Child")
-            
-        qc_rows.append({
-            "_submission__uuid": uuid,
-            "QC_Issues": "; ".join(errors) if errors else "No Errors",
-            "Total_Flags": len(errors)
-        })
-
-    qc_df = pd.DataFrame(qc_rows)
-
-    ra_col = find_column_with_suffix(df_mortality, "Type in your Name")
-    if ra_col and ra_col in df_mortality.columns:
-        qc_df = qc_df.merge(
-            df_mortality[["_uuid", ra_col]],
-            left_on="_submission__uuid",
-            right_on="_uuid",
-            how="left"
-        ).rename(columns={ra_col: "Research_Assistant"})
-    else:
-        qc_df["Research_Assistant"] = np.nan
+@st.cache_resource(max_entries=8, show_spinner="Checking duplicates across clusters...")
+def get_cross_cluster_table(data_version, peer_versions):
+    """This cluster's submissions whose household/mother/child ID also occurs in a peer cluster.
 
-    qc_df.drop(columns=["_uuid"], inplace=True, errors='ignore')
-    qc_df["Error_Percentage"] = (qc_df["Total_Flags"] / 6) * 100 
-    return qc_df
+    Computed once per combination of data versions ((cluster, version) pairs in peer_versions).
+    """
+    qc_state = get_dataset(data_version).qc_state
+    if qc_state is None:
+        return pd.DataFrame(columns=["_submission__uuid", "Check", "Key", "Other_Clusters"])
+    indexes = {CLUSTER_NAME: qc_state.duplicate_indexes}
+    for cluster, version in peer_versions:
+        peer_indexes = get_peer_indexes(cluster, version)
+        if peer_indexes is not None:
+            indexes[cluster] = peer_indexes
+    return CrossClusterIndex(indexes).table(CLUSTER_NAME)
 
 def display_qc_metric(col_obj, label, value):
     icon = "✅" if value == 0 else "🚫"
@@ -539,85 +701,44 @@ def display_qc_metric(col_obj, label, value):
         unsafe_allow_html=True
     )
 
-def generate_coverage_scorecard(df_mortality_full, df_mortality_for_metrics, target_plan_df, ward_col, community_col, unique_code_col, validation_col):
-    """Generate a Community Coverage Scorecard comparing target plans with actual submissions."""
-    
-    if target_plan_df.empty or community_col not in df_mortality_full.columns or ward_col not in df_mortality_full.columns:
-        return pd.DataFrame()
-    
-    target_plan_df = target_plan_df.copy()
-    target_plan_df['ward'] = target_plan_df['ward'].str.strip()
-    target_plan_df['community'] = target_plan_df['community'].str.strip()
-    
-    scorecard_rows = []
-    
-    for _, target_row in target_plan_df.iterrows():
-        ward_name = target_row['ward']
-        community_name = target_row['community']
-        target_plan = int(target_row.get('Target_Plan', 0))
-        
-        community_data_full = df_mortality_full[
-            (df_mortality_full[ward_col] == ward_name) & 
-            (df_mortality_full[community_col] == community_name)
-        ]
-        
-        total_submissions = len(community_data_full)
-        
-        community_data_approved = df_mortality_for_metrics[
-            (df_mortality_for_metrics[ward_col] == ward_name) & 
-            (df_mortality_for_metrics[community_col] == community_name)
-        ]
-        approved_count = len(community_data_approved)
-        
-        if validation_col in community_data_full.columns:
-            not_approved_count = (community_data_full[validation_col] == "Not Approved").sum()
-        else:
-            not_approved_count = 0
-        
-        outstanding = max(0, target_plan - approved_count)
-        
-        scorecard_rows.append({
-            'Ward': ward_name,
-            'Community': community_name,
-            'Target Plan': target_plan,
-            'Total Submissions': total_submissions,
-            'Approved Record': approved_count,
-            'Not Approved': not_approved_count,
-            'Outstanding': outstanding
-        })
-    
-    scorecard_df = pd.DataFrame(scorecard_rows)
-    scorecard_df = scorecard_df.sort_values(by=['Ward', 'Community']).reset_index(drop=True)
-    
-    return scorecard_df
-
 # ---------------- DASHBOARD LOGIC ----------------
-def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admin):
+def run_dashboard(data_version, authenticated_ward, is_admin):
     
     st.session_state.usage_count += 1
     
     st.markdown('<style>.stSidebar {display: block;}</style>', unsafe_allow_html=True)
     
+    data_as_of = st.session_state.get('data_as_of')
+    data_as_of_text = data_as_of.strftime('%H:%M') if data_as_of else "--:--"
+    if st.session_state.get('data_refreshing'):
+        data_as_of_text += " (refreshing...)"
+
     st.markdown(
         f"""
         <div class="usage-bar-container">
             <span class="usage-text">
                 Dashboard Usage Count (Runs/Refreshes): <strong>{st.session_state.usage_count}</strong>
             </span>
+            <span class="usage-text">
+                🕒 Data as of <strong>{data_as_of_text}</strong>
+            </span>
         </div>
         """,
         unsafe_allow_html=True
     )
     
+    df_mortality, df_females, df_preg = get_ward_frames(data_version)
+    qc_scope = None
+
+    # Logical field -> column, resolved once per data version in prepare_data
+    schema = get_dataset(data_version).schema
+
     # --- FILTER DATA FOR THE AUTHENTICATED WARD ---
-    WARD_COL = find_column_with_suffix(df_mortality, "ward") or "Confirm your ward"
+    WARD_COL = schema['ward'] or "Confirm your ward"
     
     if not is_admin and WARD_COL in df_mortality.columns:
-        df_mortality = df_mortality[df_mortality[WARD_COL] == authenticated_ward].copy()
-        
-        submission_uuids = df_mortality['_uuid'].unique()
-        df_females = df_females[df_females['_submission__uuid'].isin(submission_uuids)].copy()
-        df_preg = df_preg[df_preg['_submission__uuid'].isin(submission_uuids)].copy()
+        qc_scope = authenticated_ward
+        df_mortality, df_females, df_preg = get_ward_frames(data_version, qc_scope)
         
         st.success(f"✅ Access granted. Displaying data for **{authenticated_ward}** Ward only.")
         
@@ -632,13 +753,13 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
         return 
 
     # ---------------- DYNAMIC COLUMN MAPPING ----------------
-    LGA_COL = find_column_with_suffix(df_mortality, "lga") or "Confirm your LGA"
-    COMMUNITY_COL = find_column_with_suffix(df_mortality, "community") or "Confirm your community" 
-    RA_COL = find_column_with_suffix(df_mortality, "name") or "Type in your Name"
+    LGA_COL = schema['lga'] or "Confirm your LGA"
+    COMMUNITY_COL = schema['community'] or "Confirm your community" 
+    RA_COL = schema['ra'] or "Type in your Name"
     DATE_COL = "start"
     VALIDATION_COL = "_validation_status"
-    UNIQUE_CODE_COL_RAW = find_column_with_suffix(df_mortality, "unique_code") or find_column_with_suffix(df_mortality, "unique") or 'unique_code' 
-    CONSENT_DATE_COL_RAW = find_column_with_suffix(df_mortality, "consent_date") or DATE_COL
+    UNIQUE_CODE_COL_RAW = schema['unique_code'] or 'unique_code' 
+    CONSENT_DATE_COL_RAW = schema['consent_date'] or DATE_COL
     
     # ------------------ COLUMN DISPLAY NAMES ---------------------
     COMMUNITY_DISPLAY_NAME = "Confirm your community"
@@ -647,6 +768,12 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
     RA_DISPLAY_NAME = "Enumerator Name"
     UNIQUE_CODE_DISPLAY_NAME = "unique_code" 
 
+    # Per-version aggregate cube for this ward scope: drives the sidebar options and the headline metrics
+    cube_dims = tuple(col for col in (WARD_COL, LGA_COL, COMMUNITY_COL, RA_COL, VALIDATION_COL) if col in df_mortality.columns)
+    filter_options = get_filter_options(
+        data_version, qc_scope, cube_dims, DATE_COL, (WARD_COL, LGA_COL, COMMUNITY_COL, RA_COL, CUBE_DATE)
+    )
+
     # --- Sidebar Filters ---
     with st.sidebar:
         st.header(f"Data Filters for {authenticated_ward}")
@@ -658,53 +785,49 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
         community_filter_ok = COMMUNITY_COL in df_mortality.columns
         ra_filter_ok = RA_COL in df_mortality.columns
         
-        def apply_filters(df):
-            df_filtered = df.copy()
-            
+        # The same selections, as {cube column: value}, for slicing the aggregate cube
+        cube_filters = {}
+
+        def apply_filters():
+            # Options come from the per-version filter index; the selections are recorded in cube_filters
             if ward_filter_ok:
-                ward_options = sorted(df_filtered[WARD_COL].dropna().unique())
                 if is_admin:
-                    selected_ward = st.selectbox("Ward", ["All Wards"] + ward_options, index=0)
+                    selected_ward = st.selectbox("Ward", ["All Wards"] + filter_options.options(WARD_COL), index=0)
                     if selected_ward != "All Wards":
-                        df_filtered = df_filtered[df_filtered[WARD_COL] == selected_ward]
+                        cube_filters[WARD_COL] = selected_ward
                 else:
                     st.info(f"🔒 Ward filter is fixed to **{authenticated_ward}**")
             
-            if lga_filter_ok and df_filtered[LGA_COL].nunique() > 1:
-                selected_lga = st.selectbox("LGA", ["All"] + sorted(df_filtered[LGA_COL].dropna().unique()))
+            lga_options = filter_options.options(LGA_COL, cube_filters) if lga_filter_ok else []
+            if len(lga_options) > 1:
+                selected_lga = st.selectbox("LGA", ["All"] + lga_options)
                 if selected_lga != "All":
-                    df_filtered = df_filtered[df_filtered[LGA_COL] == selected_lga]
+                    cube_filters[LGA_COL] = selected_lga
             
             if community_filter_ok:
-                selected_community = st.selectbox(COMMUNITY_DISPLAY_NAME, ["All"] + sorted(df_filtered[COMMUNITY_COL].dropna().unique()))
+                selected_community = st.selectbox(COMMUNITY_DISPLAY_NAME, ["All"] + filter_options.options(COMMUNITY_COL, cube_filters))
                 if selected_community != "All":
-                    df_filtered = df_filtered[df_filtered[COMMUNITY_COL] == selected_community]
+                    cube_filters[COMMUNITY_COL] = selected_community
 
             if ra_filter_ok:
-                selected_ra = st.selectbox("Research Assistant", ["All"] + sorted(df_filtered[RA_COL].dropna().unique()))
+                selected_ra = st.selectbox("Research Assistant", ["All"] + filter_options.options(RA_COL, cube_filters))
                 if selected_ra != "All":
-                    df_filtered = df_filtered[df_filtered[RA_COL] == selected_ra]
-
-            if DATE_COL in df_filtered.columns:
-                try:
-                    df_filtered[DATE_COL] = pd.to_datetime(df_filtered[DATE_COL], errors='coerce')
-                    unique_dates = ["All"] + sorted(df_filtered[DATE_COL].dropna().dt.date.unique())
-                    selected_date = st.selectbox("Collection Date", unique_dates)
-                    if selected_date != "All":
-                        df_filtered = df_filtered[df_filtered[DATE_COL].dt.date == selected_date]
-                except Exception:
-                    pass
-            return df_filtered
-
-        df_mortality_original = df_mortality.copy()
+                    cube_filters[RA_COL] = selected_ra
+
+            if CUBE_DATE in filter_options.levels:
+                selected_date = st.selectbox("Collection Date", ["All"] + filter_options.options(CUBE_DATE, cube_filters))
+                if selected_date != "All":
+                    cube_filters[CUBE_DATE] = selected_date
+
+        df_mortality_original = df_mortality
         
-        filtered_final = apply_filters(df_mortality)
+        apply_filters()
         
-        if VALIDATION_COL in filtered_final.columns:
-            df_for_metrics = filtered_final[filtered_final[VALIDATION_COL] != "Not Approved"].copy()
-            df_for_metrics[VALIDATION_COL].fillna("Validation Ongoing", inplace=True)
-        else:
-            df_for_metrics = filtered_final.copy()
+        # The selection as a hashable key for the per-section caches
+        selection = tuple(sorted(cube_filters.items()))
+        # Only the submission UUIDs are gathered per rerun; each section gathers the columns it needs
+        metric_rows = get_selection_rows(data_version, qc_scope, cube_dims, DATE_COL, selection)[1]
+        selected_uuids = df_mortality['_uuid'].iloc[metric_rows]
 
         st.markdown("---")
         if st.button("🚪 Logout"):
@@ -717,13 +840,8 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
             st.session_state.refresh = True
             st.rerun()
 
-    submission_ids = df_for_metrics['_uuid'].unique()
-    filtered_females = df_females[df_females['_submission__uuid'].isin(submission_ids)]
-    filtered_preg = df_preg[df_preg['_submission__uuid'].isin(submission_ids)]
-
-    # Generate QC data
-    df_qc = generate_qc_dataframe(df_mortality, df_females, df_preg) 
-    filtered_df = df_qc[df_qc['_submission__uuid'].isin(df_for_metrics['_uuid'])]
+    # Headline metrics: sums over the per-version aggregate cube, sliced to the sidebar selections
+    metrics_cube = get_metrics_cube(data_version, qc_scope, cube_dims, DATE_COL, selection)
 
     # --- Dashboard Title & Metrics ---
     dashboard_title = f"SARMAAN II - QC Dashboard - {authenticated_ward} {'(Admin)' if is_admin else 'Ward'}"
@@ -733,46 +851,32 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
     st.subheader("🎯 Operational Metrics")
     with st.container():
         cols = st.columns(4)
-        cols[0].metric("Total Households Reached", f"{df_for_metrics['_uuid'].nunique():,}")
+        cols[0].metric("Total Households Reached", f"{int(metrics_cube['Submissions'].sum()):,}")
         
-        ra_col_for_metric = RA_COL if RA_COL in df_for_metrics.columns else None
-        ward_col_for_metric = WARD_COL if WARD_COL in df_for_metrics.columns else None
-        community_col_for_metric = COMMUNITY_COL if COMMUNITY_COL in df_for_metrics.columns else None
+        ra_col_for_metric = RA_COL if RA_COL in metrics_cube.columns else None
+        ward_col_for_metric = WARD_COL if WARD_COL in metrics_cube.columns else None
+        community_col_for_metric = COMMUNITY_COL if COMMUNITY_COL in metrics_cube.columns else None
 
-        cols[1].metric("Active Enumerators", df_for_metrics[ra_col_for_metric].nunique() if ra_col_for_metric else 0)
-        cols[2].metric("Wards Reached", df_for_metrics[ward_col_for_metric].nunique() if ward_col_for_metric else 0)
-        cols[3].metric("Communities Reached", df_for_metrics[community_col_for_metric].nunique() if community_col_for_metric else 0)
+        cols[1].metric("Active Enumerators", metrics_cube[ra_col_for_metric].nunique() if ra_col_for_metric else 0)
+        cols[2].metric("Wards Reached", metrics_cube[ward_col_for_metric].nunique() if ward_col_for_metric else 0)
+        cols[3].metric("Communities Reached", metrics_cube[community_col_for_metric].nunique() if community_col_for_metric else 0)
 
 
     # ---------------- QC Summary ----------------
     st.subheader("🚨 Quality Control Summary (Metrics exclude 'Not Approved')")
     with st.container():
-        cols = st.columns(6)
-        
-        born_alive_mismatch = (filtered_df["QC_Issues"].str.contains("Born Alive mismatch")).sum()
-        later_died_mismatch = (filtered_df["QC_Issues"].str.contains("Born Alive but Later Died mismatch")).sum()
-        miscarriage_mismatch = (filtered_df["QC_Issues"].str.contains("Miscarrage mismatch")).sum()
-        
-        display_qc_metric(cols[0], "Duplicate Household", (filtered_df["QC_Issues"].str.contains("Duplicate Household")).sum())
-        display_qc_metric(cols[1], "Duplicate Mother", (filtered_df["QC_Issues"].str.contains("Duplicate Mother")).sum())
-        display_qc_metric(cols[2], "Duplicate Child", (filtered_df["QC_Issues"].str.contains("Duplicate Child")).sum())
-        display_qc_metric(cols[3], "Born Alive Mismatch", born_alive_mismatch)
-        display_qc_metric(cols[4], "B.Alive, Later Died Mismatch", later_died_mismatch)
-        display_qc_metric(cols[5], "Miscarriage Mismatch", miscarriage_mismatch)
+        cols = st.columns(len(ACTIVE_RULES))
+        flag_counts = metrics_cube[ACTIVE_RULES].sum()
+        for col, name in zip(cols, ACTIVE_RULES):
+            display_qc_metric(col, QC_RULES[name]["card_label"], int(flag_counts[name]))
 
     # ---------------- Community Coverage Scorecard ----------------
     st.markdown("---")
     st.subheader("📊 Community Coverage Scorecard (Target Plan vs. Submissions)")
     
     if not TARGET_PLAN_DF.empty:
-        coverage_scorecard = generate_coverage_scorecard(
-            df_mortality_original,
-            df_for_metrics,
-            TARGET_PLAN_DF,
-            WARD_COL,
-            COMMUNITY_COL,
-            UNIQUE_CODE_COL_RAW,
-            VALIDATION_COL
+        coverage_scorecard = get_coverage_scorecard(
+            data_version, qc_scope, cube_dims, DATE_COL, selection, WARD_COL, COMMUNITY_COL
         )
         
         if not coverage_scorecard.empty:
@@ -815,10 +919,51 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
     else:
         st.warning("⚠️ Target plan data not loaded. Cannot generate coverage scorecard.")
 
+    # ---------------- Daily Coverage & QC Trend ----------------
+    st.markdown("---")
+    st.subheader("📅 Daily Coverage & QC Trend (Metrics exclude 'Not Approved')")
+    # Every collection day of the current ward/LGA/community/RA selection; the date filter does not apply here
+    trend_filters = {col: value for col, value in cube_filters.items() if col != CUBE_DATE}
+    if not is_admin:
+        trend_filters[WARD_COL] = authenticated_ward
+    trend_by_day = get_trend_series(data_version, qc_scope, tuple(sorted(trend_filters.items())))
+
+    if not trend_by_day.empty:
+        target_plan = TARGET_PLAN_DF
+        for col, plan_col in ((WARD_COL, 'ward'), (LGA_COL, 'lga'), (COMMUNITY_COL, 'community')):
+            if col in trend_filters and plan_col in target_plan.columns:
+                target_plan = target_plan[target_plan[plan_col] == trend_filters[col]]
+        target_total = int(target_plan['Target_Plan'].sum()) if 'Target_Plan' in target_plan.columns else 0
+
+        col1, col2, col3, col4 = st.columns(4)
+        col1.metric("Collection Days", f"{len(trend_by_day):,}")
+        col2.metric("Cumulative Approved", f"{int(trend_by_day['Cumulative Approved'].iloc[-1]):,}")
+        col3.metric("Cumulative QC Flagged", f"{int(trend_by_day['Cumulative Flagged'].iloc[-1]):,}")
+        col4.metric("Cumulative Error Rate", f"{trend_by_day['Cumulative Error Rate %'].iloc[-1]:.1f}%")
+
+        cumulative = trend_by_day[["Cumulative Approved", "Cumulative Flagged"]]
+        # The target plan is per community, so it has no per-enumerator line
+        if target_total > 0 and RA_COL not in trend_filters:
+            cumulative = cumulative.assign(**{"Target Plan": target_total})
+        st.line_chart(cumulative, use_container_width=True)
+        st.bar_chart(
+            trend_by_day[["Approved Records", "Flagged Records"]],
+            use_container_width=True,
+            color=["#2E7D32", "#D32F2F"]
+        )
+        if qc_scope is None:
+            st.caption("QC flags in the trend check duplicates across all wards.")
+    else:
+        st.info("📋 No daily trend data available for the current selection.")
+
     # ---------------- Errors by Enumerator ----------------
     st.markdown("---")
     st.subheader("📈 QC Errors by Enumerator (Excluding 'Not Approved')")
-    error_by_ra = filtered_df.groupby("Research_Assistant")['Total_Flags'].sum().reset_index()
+    if RA_COL in metrics_cube.columns:
+        qc_cells = metrics_cube[metrics_cube['QC_Submissions'] > 0]
+        error_by_ra = qc_cells.groupby(RA_COL, observed=True)['Total_Flags'].sum().rename_axis("Research_Assistant").reset_index()
+    else:
+        error_by_ra = pd.DataFrame({"Research_Assistant": [], "Total_Flags": []})
     error_by_ra = error_by_ra.sort_values(by='Total_Flags', ascending=False)
     st.bar_chart(
         error_by_ra.set_index("Research_Assistant"),
@@ -830,10 +975,10 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
     st.subheader("🏠 Duplicate Household Submissions (Only Approved/On Hold)")
     st.caption("⚠️ Note: 'Not Approved' records are excluded from duplicate detection")
     
-    if UNIQUE_CODE_COL_RAW in df_for_metrics.columns:
-        # CRITICAL: Use df_for_metrics which already excludes "Not Approved"
-        dupe_mask = df_for_metrics.duplicated(subset=UNIQUE_CODE_COL_RAW, keep=False)
-        duplicate_households = df_for_metrics[dupe_mask].sort_values(by=UNIQUE_CODE_COL_RAW).copy()
+    if UNIQUE_CODE_COL_RAW in df_mortality.columns:
+        duplicate_households = get_duplicate_households(
+            data_version, qc_scope, cube_dims, DATE_COL, selection, UNIQUE_CODE_COL_RAW
+        )
 
         if not duplicate_households.empty:
             display_dupe_cols = [
@@ -854,9 +999,8 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
             })
             
             if 'Submission Date' in display_dupe_df.columns:
-                 display_dupe_df['Submission Date'] = pd.to_datetime(
-                     display_dupe_df['Submission Date'], errors='coerce'
-                 ).dt.strftime('%Y-%m-%d %H:%M')
+                 # `start` is parsed to datetime once at load (normalize_mortality)
+                 display_dupe_df['Submission Date'] = display_dupe_df['Submission Date'].dt.strftime('%Y-%m-%d %H:%M')
                  
             st.dataframe(display_dupe_df, use_container_width=True, height=300)
             st.warning(f"❗ **{len(display_dupe_df):,}** submissions share the same **{UNIQUE_CODE_DISPLAY_NAME}** (excluding 'Not Approved'). They should be reviewed.")
@@ -865,26 +1009,41 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
     else:
         st.error(f"❌ Cannot check for household duplicates. Unique Code column ('{UNIQUE_CODE_COL_RAW}') not found.")
 
+    # ---------------- CROSS-CLUSTER DUPLICATES ----------------
+    st.subheader("🔀 Duplicates Across Clusters (Only Approved/On Hold)")
+    st.caption(f"Household, mother and child IDs in this view that were also submitted in {', '.join(PEER_CLUSTERS)}")
+
+    peer_versions = []
+    for cluster in PEER_CLUSTERS:
+        peer_version = get_peer_version(cluster)
+        if peer_version is not None:
+            peer_versions.append((cluster, peer_version))
+        else:
+            st.info(f"⏳ No {cluster} data has been published yet; the cross-cluster check will appear once the {cluster} dashboard has synced.")
+
+    if peer_versions and get_dataset(data_version).qc_state is not None:
+        cross_df = get_cross_cluster_table(data_version, tuple(peer_versions))
+        cross_df = cross_df[cross_df['_submission__uuid'].isin(selected_uuids)]
+        if not cross_df.empty:
+            st.dataframe(
+                cross_df.rename(columns={'_submission__uuid': 'Submission UUID', 'Other_Clusters': 'Also Submitted In'}),
+                use_container_width=True, height=300
+            )
+            st.warning(f"❗ **{cross_df['_submission__uuid'].nunique():,}** submissions share an ID with another cluster. They should be reviewed.")
+        else:
+            st.info("✅ No duplicates found across clusters.")
+
 
     # ---------------- Detailed Error Records ----------------
     st.markdown("---")
     st.subheader("📋 Detailed Internal/Cross-Check Error Records (Excluding 'Not Approved')")
-    display_df = filtered_df[filtered_df['Total_Flags'] > 0].copy()
-    
-    dupe_cols = ['_uuid', UNIQUE_CODE_COL_RAW, CONSENT_DATE_COL_RAW, VALIDATION_COL, LGA_COL, WARD_COL, COMMUNITY_COL, RA_COL]
-    present_dupe_cols = [col for col in dupe_cols if col in df_for_metrics.columns]
-    dupe_df = df_for_metrics[present_dupe_cols].rename(columns={'_uuid': '_submission__uuid'}).copy()
-    
-    if RA_COL in dupe_df.columns:
-        dupe_df.rename(columns={RA_COL: 'Research_Assistant_Merge'}, inplace=True)
-
-    if CONSENT_DATE_COL_RAW in dupe_df.columns and pd.api.types.is_datetime64_any_dtype(dupe_df[CONSENT_DATE_COL_RAW]):
-        dupe_df[CONSENT_DATE_COL_RAW] = dupe_df[CONSENT_DATE_COL_RAW].dt.strftime('%Y-%m-%d')
-        
-    display_df = display_df.merge(dupe_df, on="_submission__uuid", how="left")
-    display_df.drop(columns=["Research_Assistant_Merge"], inplace=True, errors='ignore')
+    dupe_cols = ('_uuid', UNIQUE_CODE_COL_RAW, CONSENT_DATE_COL_RAW, VALIDATION_COL, LGA_COL, WARD_COL, COMMUNITY_COL, RA_COL)
+    display_df = get_error_records(
+        data_version, qc_scope, cube_dims, DATE_COL, selection, dupe_cols, RA_COL, CONSENT_DATE_COL_RAW
+    )
 
-    display_df.rename(columns={
+    # The cached merge is shared, so rename into a new frame
+    display_df = display_df.rename(columns={
         LGA_COL: LGA_DISPLAY_NAME, 
         WARD_COL: WARD_DISPLAY_NAME, 
         COMMUNITY_COL: COMMUNITY_DISPLAY_NAME,
@@ -895,7 +1054,7 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
         CONSENT_DATE_COL_RAW: 'Date of Consent',
         VALIDATION_COL: 'Validation Status', 
         'Research_Assistant': RA_DISPLAY_NAME 
-    }, inplace=True)
+    })
 
     display_cols = [
         'Submission UUID', 
@@ -922,31 +1081,13 @@ def run_dashboard(df_mortality, df_females, df_preg, authenticated_ward, is_admi
     st.subheader("💬 Records with Validation Comments/Justification (Not Approved / On Hold)")
     st.caption("📅 Showing records from December 11, 2025 onwards | Excluding 'Approved' records")
     
-    # Find the validation comment column - check both in df_for_metrics and df_mortality_original
-    VALIDATION_COMMENT_COL = find_column_with_suffix(df_mortality_original, "Validation Comment") or find_column_with_suffix(df_mortality_original, "Justification")
+    # The validation comment column ("Validation Comment", else "Justification") from the resolved schema
+    VALIDATION_COMMENT_COL = schema['validation_comment']
     
     if VALIDATION_COMMENT_COL and VALIDATION_COMMENT_COL in df_mortality_original.columns:
-        # Start with the original filtered data (respects ward filtering)
-        df_comments_base = filtered_final.copy()
-        
-        # Filter 1: Only records with non-empty validation comments
-        df_with_comments = df_comments_base[
-            df_comments_base[VALIDATION_COMMENT_COL].notna() & 
-            (df_comments_base[VALIDATION_COMMENT_COL].astype(str).str.strip() != '')
-        ].copy()
-        
-        # Filter 2: Exclude 'Approved' records - only show 'Not Approved' or 'On Hold'
-        if VALIDATION_COL in df_with_comments.columns:
-            df_with_comments = df_with_comments[
-                (df_with_comments[VALIDATION_COL] == "Not Approved") | 
-                (df_with_comments[VALIDATION_COL] == "On Hold")
-            ].copy()
-        
-        # Filter 3: Only records from December 11, 2025 onwards
-        if DATE_COL in df_with_comments.columns:
-            df_with_comments[DATE_COL] = pd.to_datetime(df_with_comments[DATE_COL], errors='coerce')
-            cutoff_date = pd.to_datetime('2025-12-11')
-            df_with_comments = df_with_comments[df_with_comments[DATE_COL] >= cutoff_date].copy()
+        df_with_comments = get_comment_records(
+            data_version, qc_scope, cube_dims, DATE_COL, selection, VALIDATION_COMMENT_COL
+        )
         
         if not df_with_comments.empty:
             # Select relevant columns for display
@@ -1004,25 +1145,16 @@ elif st.session_state.page_view == 'dashboard':
     # If authenticated, load data and show the dashboard
     force_refresh_flag = st.session_state.get('refresh', False)
 
-    # Check if data exists in cache or needs a refresh
-    if 'df_mortality' not in st.session_state or force_refresh_flag:
-        # Load full data first (Admin or Ward User gets the same full dataset from the web)
-        df_mortality, df_females, df_preg = load_data(force_refresh=force_refresh_flag)
-        st.session_state.df_mortality = df_mortality
-        st.session_state.df_females = df_females
-        st.session_state.df_preg = df_preg
-    else:
-        df_mortality = st.session_state.df_mortality
-        df_females = st.session_state.df_females
-        df_preg = st.session_state.df_preg
+    # Always pick up the latest snapshot the background refresher has swapped in
+    # (Admin or Ward User gets the same full dataset; a forced refresh runs in the background).
+    # The session only keeps the version id - the frames themselves live once per process.
+    st.session_state.data_version = load_data(force_refresh=force_refresh_flag)
         
     st.session_state.refresh = False  # Reset the flag after check
 
     # Run dashboard with the authenticated user's context
     run_dashboard(
-    df_mortality, 
-    df_females, 
-    df_preg, 
+    st.session_state.data_version,
     st.session_state.authenticated_ward,
     st.session_state.is_admin
 )
@@ -0,0 +1,794 @@
+# ================================
+# SARMAAN II KOBO DATA ACCESS (shared by the Cluster 1 / Cluster 2 dashboards)
+# IMPLEMENTS: Full XLSX export download + incremental sync by submission watermark
+#             + on-disk Parquet snapshot with conditional GET
+#             + streaming, column-pruned reader for the three QC sheets
+#             + single-flight sync per Kobo asset (no download stampedes)
+#             + stale-while-revalidate background refresher
+# ================================
+
+import hashlib
+import json
+import logging
+import os
+import re
+import shutil
+import threading
+import time
+from collections import OrderedDict, namedtuple
+from datetime import datetime
+from io import BytesIO
+
+import pandas as pd
+import requests
+from openpyxl import load_workbook
+
+from qc_engine import SCHEMA_FIELDS, SCHEMA_SHEETS, match_column
+
+logger = logging.getLogger(__name__)
+
+# ---------------- SYNC CONFIG ----------------
+KOBO_API_TOKEN = os.environ.get("KOBO_API_TOKEN")
+EXPORT_TIMEOUT = 300
+API_TIMEOUT = 60
+DATA_PAGE_SIZE = 1000
+# Incremental sync cannot see deleted submissions, so rebuild from the full export now and then.
+FULL_RESYNC_INTERVAL = 6 * 60 * 60
+REFRESH_INTERVAL = 600
+# Published versions kept alive so a session that started rendering version N can finish after N+1 lands
+RETAINED_VERSIONS = 2
+SNAPSHOT_DIR = os.environ.get("QC_SNAPSHOT_DIR", ".kobo_cache")
+# Superseded snapshot versions are deleted once this old, so a reader (or writer) in another process is never cut off
+SNAPSHOT_PRUNE_AFTER = 600
+# The XLSX export carries no validation timestamps, so after a full sync the validation watermark
+# falls back to the local clock, set back by this much to absorb skew against Kobo's server clock
+VALIDATION_TS_MARGIN = 300
+
+# Wall-clock zone of the XLSX export's date/time cells; JSON `start`/`end` carry the device's UTC offset instead
+EXPORT_TZ = os.environ.get("KOBO_EXPORT_TZ", "Africa/Lagos")
+# JSON timestamp fields, converted to the form (datetime or ISO text) the export sheet holds them in
+DATETIME_FIELDS = ("start", "end", "_submission_time")
+
+SUBMISSION_KEY = "_uuid"
+CHILD_SUBMISSION_KEY = "_submission__uuid"
+VALIDATION_COL = "_validation_status"
+
+# --- Columns the dashboards actually use, per sheet (mortality, female, pregnancy_history) ---
+# "exact" headers are kept as-is; for each schema field the header qc_engine's resolver would pick
+# (match_column over its candidates) is kept, so resolving on the pruned frame gives the same column.
+_EXACT_COLUMNS = (
+    ["_id", "_uuid", "_submission_time", "_validation_status", "start"],
+    ["mother_id", "_index", "_parent_index", "_submission__id", "_submission__uuid"],
+    ["child_id", "_index", "_parent_index", "_submission__id", "_submission__uuid"],
+)
+QC_COLUMN_SPECS = tuple(
+    {
+        "exact": exact,
+        "fields": [candidates for field_sheet, candidates in SCHEMA_FIELDS.values() if field_sheet == sheet],
+    }
+    for sheet, exact in zip(SCHEMA_SHEETS, _EXACT_COLUMNS)
+)
+
+
+def _api_headers():
+    if KOBO_API_TOKEN:
+        return {"Authorization": f"Token {KOBO_API_TOKEN}"}
+    return {}
+
+
+def asset_api_base(data_url):
+    """Return the `.../api/v2/assets/<uid>` prefix of an export-settings URL."""
+    match = re.match(r"^(https?://[^/]+/api/v2/assets/[^/]+)", data_url)
+    if not match:
+        raise ValueError(f"Not a KoboToolbox v2 asset URL: {data_url}")
+    return match.group(1)
+
+
+# ---------------- FULL EXPORT ----------------
+def download_export(data_url, etag=None, last_modified=None):
+    """Conditionally download the XLSX export.
+
+    Returns (content, validators); content is None when the server answers 304 Not Modified.
+    """
+    headers = _api_headers()
+    if etag:
+        headers["If-None-Match"] = etag
+    if last_modified:
+        headers["If-Modified-Since"] = last_modified
+    response = requests.get(data_url, headers=headers, timeout=EXPORT_TIMEOUT)
+    validators = {"etag": response.headers.get("ETag"), "last_modified": response.headers.get("Last-Modified")}
+    if response.status_code == 304:
+        return None, validators
+    response.raise_for_status()
+    return response.content, validators
+
+
+def _select_columns(headers, spec):
+    """Indices of the headers to keep: exact matches plus the header each schema field resolves to."""
+    keep = set()
+    seen = set()
+    for i, header in enumerate(headers):
+        if header is None or header in seen:
+            continue
+        seen.add(header)
+        if header in spec.get("exact", ()):
+            keep.add(i)
+    for candidates in spec.get("fields", ()):
+        match = match_column(headers, candidates)
+        if match is not None:
+            keep.add(headers.index(match))
+    return sorted(keep)
+
+
+def _read_sheet(worksheet, spec):
+    """Stream one worksheet row by row, holding only the selected columns."""
+    worksheet.reset_dimensions()
+    rows = worksheet.iter_rows(values_only=True)
+    header_row = next(rows, None)
+    if header_row is None:
+        return pd.DataFrame()
+    headers = [str(h) if h is not None else None for h in header_row]
+    keep = _select_columns(headers, spec) if spec is not None else [i for i, h in enumerate(headers) if h is not None]
+
+    data = []
+    for row in rows:
+        values = [row[i] if i < len(row) else None for i in keep]
+        if any(v is not None for v in values):
+            data.append(values)
+    return pd.DataFrame(data, columns=[headers[i] for i in keep])
+
+
+def parse_workbook(content, sheet_names, column_specs=QC_COLUMN_SPECS):
+    """Parse only the requested sheets (and columns) out of an XLSX export; missing sheets are empty.
+
+    Uses openpyxl's read-only mode so the workbook is streamed instead of materialised.
+    Pass column_specs=None to keep every column.
+    """
+    workbook = load_workbook(BytesIO(content), read_only=True, data_only=True)
+    try:
+        frames = []
+        for i, name in enumerate(sheet_names):
+            spec = column_specs[i] if column_specs is not None else None
+            frames.append(_read_sheet(workbook[name], spec) if name in workbook.sheetnames else pd.DataFrame())
+        return tuple(frames)
+    finally:
+        workbook.close()
+
+
+def content_fingerprint(content):
+    return hashlib.sha256(content).hexdigest()
+
+
+# ---------------- SNAPSHOT STORE ----------------
+def _parquet_safe(df):
+    """Stringify object columns holding mixed Python types, which Arrow cannot store as one column."""
+    df = df.copy()
+    df.columns = [str(col) for col in df.columns]
+    for col in df.columns[df.dtypes == object]:
+        if pd.api.types.infer_dtype(df[col], skipna=True).startswith("mixed"):
+            df[col] = df[col].map(lambda v: v if pd.isna(v) else str(v))
+    return df
+
+
+class SnapshotStore:
+    """Parquet copy of the three parsed sheets plus a JSON manifest (fingerprint, HTTP validators, watermark).
+
+    Each save writes its sheets into a new `v-*` directory and then atomically replaces manifest.json,
+    which names that directory, so readers in any process sharing the store see one consistent set.
+    """
+
+    MANIFEST = "manifest.json"
+
+    def __init__(self, directory, sheet_names):
+        self.directory = directory
+        self.sheet_names = sheet_names
+
+    def _sheet_path(self, data_dir, index):
+        # data_dir "" is the flat layout of snapshots written before versioned directories
+        return os.path.join(self.directory, data_dir, f"sheet_{index}.parquet")
+
+    def manifest(self):
+        try:
+            with open(os.path.join(self.directory, self.MANIFEST), encoding="utf-8") as fh:
+                manifest = json.load(fh)
+        except (OSError, ValueError):
+            return {}
+        return manifest if manifest.get("sheets") == list(self.sheet_names) else {}
+
+    def load(self):
+        """Return (frames, manifest), or (None, {}) when there is no usable snapshot."""
+        error = None
+        # A writer in another process may prune the set we were pointed at; re-read the pointer once
+        for _ in range(2):
+            manifest = self.manifest()
+            if not manifest:
+                return None, {}
+            data_dir = manifest.get("data_dir", "")
+            try:
+                frames = tuple(pd.read_parquet(self._sheet_path(data_dir, i)) for i in range(len(self.sheet_names)))
+            except Exception as e:
+                error = e
+                continue
+            return frames, manifest
+        logger.warning("Ignoring unreadable snapshot in %s: %s", self.directory, error)
+        return None, {}
+
+    def save(self, frames, **manifest):
+        """Write the sheets into a new version directory, then atomically repoint manifest.json at it."""
+        os.makedirs(self.directory, exist_ok=True)
+        previous = self.manifest()
+        previous_dir = previous.get("data_dir", "") if previous else None
+        data_dir = f"v-{time.time_ns()}-{os.getpid()}-{threading.get_ident()}"
+        staging = os.path.join(self.directory, data_dir)
+        os.makedirs(staging)
+        manifest_tmp = os.path.join(self.directory, f"{self.MANIFEST}.{data_dir}.tmp")
+        try:
+            for i, frame in enumerate(frames):
+                _parquet_safe(frame).to_parquet(self._sheet_path(data_dir, i), index=False)
+            manifest.update(sheets=list(self.sheet_names), saved_at=time.time(), data_dir=data_dir)
+            with open(manifest_tmp, "w", encoding="utf-8") as fh:
+                json.dump(manifest, fh)
+            os.replace(manifest_tmp, os.path.join(self.directory, self.MANIFEST))
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            if os.path.exists(manifest_tmp):
+                os.remove(manifest_tmp)
+            raise
+        self._prune(keep={data_dir, previous_dir})
+
+    def update_manifest(self, fingerprint, **fields):
+        """Rewrite only the manifest (same sheets) with `fields`, if the stored snapshot still has `fingerprint`.
+
+        Returns False when there is no such snapshot, so the caller can fall back to a full save().
+        """
+        manifest = self.manifest()
+        if not manifest or manifest.get("fingerprint") != fingerprint:
+            return False
+        manifest.update(fields, saved_at=time.time())
+        manifest_tmp = os.path.join(self.directory, f"{self.MANIFEST}.{os.getpid()}-{threading.get_ident()}.tmp")
+        with open(manifest_tmp, "w", encoding="utf-8") as fh:
+            json.dump(manifest, fh)
+        os.replace(manifest_tmp, os.path.join(self.directory, self.MANIFEST))
+        return True
+
+    def _prune(self, keep):
+        """Delete superseded version directories (and flat-layout sheets) older than SNAPSHOT_PRUNE_AFTER."""
+        cutoff = time.time() - SNAPSHOT_PRUNE_AFTER
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            stale_version = name.startswith("v-") and name not in keep
+            stale_flat_sheet = name.startswith("sheet_") and name.endswith(".parquet") and "" not in keep
+            try:
+                if (stale_version or stale_flat_sheet) and os.path.getmtime(path) < cutoff:
+                    if os.path.isdir(path):
+                        shutil.rmtree(path, ignore_errors=True)
+                    else:
+                        os.remove(path)
+            except OSError:
+                pass
+
+
+# ---------------- FORM SCHEMA (names -> export headers/labels) ----------------
+def _first_label(label):
+    if isinstance(label, list):
+        label = next((item for item in label if item), None)
+    return label or None
+
+
+def fetch_form_schema(asset_base):
+    """Read the deployed form so JSON field/choice names can be mapped to the XLSX export's labels."""
+    response = requests.get(f"{asset_base}/", params={"format": "json"}, headers=_api_headers(), timeout=API_TIMEOUT)
+    response.raise_for_status()
+    content = response.json().get("content", {})
+
+    field_labels, select_lists = {}, {}
+    for row in content.get("survey", []):
+        name = row.get("name") or row.get("$autoname")
+        if not name:
+            continue
+        label = _first_label(row.get("label"))
+        if label:
+            field_labels[name] = label
+        if row.get("select_from_list_name"):
+            select_lists[name] = row["select_from_list_name"]
+
+    choice_labels = {}
+    for choice in content.get("choices", []):
+        label = _first_label(choice.get("label"))
+        if label:
+            choice_labels.setdefault(choice.get("list_name"), {})[str(choice.get("name"))] = label
+
+    return {"field_labels": field_labels, "select_lists": select_lists, "choice_labels": choice_labels}
+
+
+# ---------------- INCREMENTAL FETCH ----------------
+def fetch_submissions_since(asset_base, watermark):
+    """Page through the data API for submissions newer than the watermark or re-validated since it."""
+    clauses = [{"_id": {"$gt": int(watermark["last_id"])}}]
+    if watermark.get("last_submission_time"):
+        clauses.append({"_submission_time": {"$gt": watermark["last_submission_time"]}})
+    if watermark.get("last_validation_ts"):
+        clauses.append({"_validation_status.timestamp": {"$gt": int(watermark["last_validation_ts"])}})
+
+    params = {
+        "format": "json",
+        "query": json.dumps({"$or": clauses}),
+        "sort": json.dumps({"_id": 1}),
+        "limit": DATA_PAGE_SIZE,
+    }
+    url = f"{asset_base}/data/"
+    records = []
+    while url:
+        response = requests.get(url, params=params, headers=_api_headers(), timeout=API_TIMEOUT)
+        response.raise_for_status()
+        payload = response.json()
+        records.extend(payload.get("results", []))
+        # `next` already carries the query string
+        url, params = payload.get("next"), None
+    return records
+
+
+def _validation_label(status):
+    if isinstance(status, dict):
+        return status.get("label") or None
+    return status or None
+
+
+def flatten_submissions(records, main_sheet):
+    """Split nested JSON submissions into one row list per table, keyed like the XLSX export sheets."""
+    tables = {main_sheet: []}
+
+    for record in records:
+        validation = _validation_label(record.get(VALIDATION_COL))
+        parent_meta = {
+            "_submission__id": record.get("_id"),
+            CHILD_SUBMISSION_KEY: record.get(SUBMISSION_KEY),
+            "_submission__submission_time": record.get("_submission_time"),
+            "_submission__validation_status": validation,
+        }
+
+        def walk(obj, row, table_name):
+            for key, value in obj.items():
+                name = key.rsplit("/", 1)[-1]
+                if isinstance(value, list) and value and isinstance(value[0], dict) and not name.startswith("_"):
+                    for item in value:
+                        child_row = dict(parent_meta, _parent_table_name=table_name)
+                        walk(item, child_row, name)
+                        tables.setdefault(name, []).append(child_row)
+                elif not isinstance(value, (list, dict)):
+                    row[name] = value
+
+        main_row = {}
+        walk(record, main_row, main_sheet)
+        main_row[VALIDATION_COL] = validation
+        tables[main_sheet].append(main_row)
+
+    return tables
+
+
+def _export_datetimes(values, template_col):
+    """JSON timestamps in the template column's form: offset-qualified ones (`start`) as EXPORT_TZ wall-clock
+    time, offset-less ones (`_submission_time`, UTC) as they are; datetimes, or ISO text if the sheet holds text."""
+    text = values.astype("string")
+    has_offset = text.str.contains(r"(?:[+-]\d{2}:?\d{2}|Z)$", na=False).to_numpy()
+    parsed = pd.Series(pd.NaT, index=values.index, dtype="datetime64[ns]")
+    if has_offset.any():
+        parsed[has_offset] = pd.to_datetime(text[has_offset], errors="coerce", utc=True) \
+            .dt.tz_convert(EXPORT_TZ).dt.tz_localize(None)
+    if (~has_offset).any():
+        parsed[~has_offset] = pd.to_datetime(text[~has_offset], errors="coerce", format="ISO8601")
+
+    if isinstance(template_col.dtype, pd.DatetimeTZDtype):
+        return parsed.dt.tz_localize(EXPORT_TZ).dt.tz_convert(template_col.dt.tz)
+    if pd.api.types.is_datetime64_any_dtype(template_col):
+        return parsed.astype(template_col.dtype)
+    sample = template_col.dropna()
+    if not sample.empty and isinstance(sample.iloc[0], str):
+        return parsed.dt.strftime("%Y-%m-%dT%H:%M:%S")
+    return parsed
+
+
+def _rows_to_export_frame(rows, template, schema):
+    """Rename JSON field names to the template's headers, relabel choices and align dtypes."""
+    if not rows:
+        return template.iloc[0:0]
+
+    new_rows = pd.DataFrame(rows)
+    field_labels = schema.get("field_labels", {})
+    select_lists = schema.get("select_lists", {})
+    choice_labels = schema.get("choice_labels", {})
+    columns = set(template.columns)
+
+    rename = {}
+    for name in new_rows.columns:
+        if name in columns:
+            continue
+        label = field_labels.get(name)
+        if label in columns:
+            rename[name] = label
+            choices = choice_labels.get(select_lists.get(name), {})
+            if choices:
+                new_rows[name] = new_rows[name].map(
+                    lambda v: " ".join(choices.get(part, part) for part in str(v).split()) if pd.notna(v) else v
+                )
+    new_rows = new_rows.rename(columns=rename)
+    new_rows = new_rows.loc[:, ~new_rows.columns.duplicated()].reindex(columns=template.columns)
+
+    for col in template.columns:
+        if col in DATETIME_FIELDS or pd.api.types.is_datetime64_any_dtype(template[col]):
+            new_rows[col] = _export_datetimes(new_rows[col], template[col])
+        elif pd.api.types.is_numeric_dtype(template[col]) and not pd.api.types.is_bool_dtype(template[col]):
+            new_rows[col] = pd.to_numeric(new_rows[col], errors="coerce")
+    return new_rows
+
+
+def _upsert(frame, new_rows, key, changed_uuids):
+    if key not in frame.columns:
+        return frame
+    kept = frame[~frame[key].isin(changed_uuids)]
+    if new_rows.empty:
+        return kept.reset_index(drop=True)
+    return pd.concat([kept, new_rows], ignore_index=True)
+
+
+def _newest_validation_ts(records, previous_ts):
+    stamps = [
+        record["_validation_status"].get("timestamp")
+        for record in records
+        if isinstance(record.get("_validation_status"), dict)
+    ]
+    stamps = [int(ts) for ts in stamps if isinstance(ts, (int, float))]
+    return max(stamps + [int(previous_ts or 0)])
+
+
+def _watermark_from(df_mortality, validation_ts):
+    last_id = pd.to_numeric(df_mortality.get("_id"), errors="coerce").max() if "_id" in df_mortality.columns else None
+    submission_times = pd.to_datetime(df_mortality.get("_submission_time"), errors="coerce") \
+        if "_submission_time" in df_mortality.columns else pd.Series(dtype="datetime64[ns]")
+    last_time = submission_times.max()
+    return {
+        "last_id": int(last_id) if pd.notna(last_id) else 0,
+        "last_submission_time": last_time.strftime("%Y-%m-%dT%H:%M:%S") if pd.notna(last_time) else None,
+        "last_validation_ts": int(validation_ts),
+    }
+
+
+# ---------------- SINGLE-FLIGHT ----------------
+class _Flight:
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class SingleFlight:
+    """Collapse concurrent calls into one execution; every caller that arrives meanwhile shares its result."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flight = None
+
+    def in_flight(self):
+        return self._flight is not None
+
+    def do(self, fn):
+        with self._lock:
+            flight = self._flight
+            leader = flight is None
+            if leader:
+                flight = self._flight = _Flight()
+
+        if leader:
+            try:
+                flight.value = fn()
+            except BaseException as e:
+                flight.error = e
+            finally:
+                with self._lock:
+                    self._flight = None
+                flight.done.set()
+        else:
+            flight.done.wait()
+
+        if flight.error is not None:
+            raise flight.error
+        return flight.value
+
+
+# ---------------- SYNC STATE ----------------
+class KoboSync:
+    """Holds the last synced mortality/female/pregnancy_history frames for one Kobo asset.
+
+    The first sync (and one every FULL_RESYNC_INTERVAL) goes to the full XLSX export;
+    every other sync only pulls submissions past the `_id`/`_submission_time` watermark plus
+    any whose validation status changed, and upserts them by submission UUID.
+    Every sync is persisted to a Parquet snapshot, so a restart resumes from disk and an
+    unchanged export (304, or same content hash) is never parsed twice.
+    """
+
+    def __init__(self, data_url, main_sheet, females_sheet, preg_sheet, snapshot_dir=SNAPSHOT_DIR):
+        self.data_url = data_url
+        self.sheet_names = (main_sheet, females_sheet, preg_sheet)
+        self.frames = None
+        self.version = None
+        # (version the last sync started from, submission UUIDs it touched); None after a full rebuild
+        self.last_changes = None
+        self.watermark = None
+        self.schema = None
+        self.last_full_sync = 0.0
+        self.validators = {}
+        self.fingerprint = None
+        # saved_at of the on-disk snapshot the frames were restored from, if any
+        self.restored_at = None
+        self.store = None
+        if snapshot_dir:
+            asset_uid = asset_api_base(data_url).rsplit("/", 1)[-1]
+            self.store = SnapshotStore(os.path.join(snapshot_dir, asset_uid), self.sheet_names)
+        self._lock = threading.Lock()
+        self._flight = SingleFlight()
+
+    def sync(self, full=False, wait=True):
+        """Bring the held frames up to date and return (df_mortality, df_females, df_preg).
+
+        Concurrent callers join the sync already in flight instead of starting their own download.
+        With wait=False a caller that finds one in flight gets the previous frames straight away.
+        """
+        if not wait and self.frames is not None and self._flight.in_flight():
+            return self.frames
+        return self._flight.do(lambda: self._sync(full))
+
+    def restore(self):
+        """Load the on-disk snapshot (no network) if nothing is held yet, and return the held frames or None."""
+        with self._lock:
+            if self.frames is None:
+                self._restore_snapshot()
+            return self.frames
+
+    def _sync(self, full):
+        with self._lock:
+            if self.frames is None:
+                self._restore_snapshot()
+            stale = time.time() - self.last_full_sync > FULL_RESYNC_INTERVAL
+            if full or self.frames is None or stale:
+                self._full_sync()
+            else:
+                try:
+                    self._incremental_sync()
+                except Exception as e:
+                    logger.warning("Incremental Kobo sync failed (%s); falling back to full export.", e)
+                    self._full_sync()
+            return self.frames
+
+    def _set_frames(self, frames):
+        """Swap in new frames and derive a version id that changes whenever their content does."""
+        self.frames = frames
+        sizes = "|".join(str(len(frame)) for frame in frames)
+        token = f"{self.fingerprint}|{json.dumps(self.watermark, sort_keys=True)}|{sizes}"
+        self.version = hashlib.sha1(token.encode("utf-8")).hexdigest()[:16]
+
+    def _restore_snapshot(self):
+        if self.store is None:
+            return
+        frames, manifest = self.store.load()
+        if frames is None:
+            return
+        self.watermark = manifest.get("watermark")
+        self.last_full_sync = manifest.get("last_full_sync", 0.0)
+        self.validators = manifest.get("validators", {})
+        self.fingerprint = manifest.get("fingerprint")
+        self.restored_at = manifest.get("saved_at")
+        self._set_frames(frames)
+
+    def _persist(self, metadata_only=False):
+        """Save the held frames, or with metadata_only just the manifest when the sheets on disk are unchanged."""
+        if self.store is None:
+            return
+        try:
+            if metadata_only and self.store.update_manifest(
+                self.fingerprint, validators=self.validators, last_full_sync=self.last_full_sync
+            ):
+                return
+            self.store.save(
+                self.frames,
+                fingerprint=self.fingerprint,
+                validators=self.validators,
+                watermark=self.watermark,
+                last_full_sync=self.last_full_sync,
+            )
+        except Exception as e:
+            logger.warning("Could not write Kobo snapshot: %s", e)
+
+    def _derived_store(self, name, frame_names):
+        return SnapshotStore(os.path.join(self.store.directory, name), frame_names)
+
+    def load_derived(self, name, frame_names):
+        """Frames saved by save_derived() under `name`, or None. They may lag the held frames by a version."""
+        if self.store is None:
+            return None
+        return self._derived_store(name, frame_names).load()[0]
+
+    def save_derived(self, name, frame_names, frames):
+        """Persist frames derived from the synced data (e.g. a rolled-up trend) next to the snapshot; best effort."""
+        if self.store is None:
+            return
+        try:
+            self._derived_store(name, frame_names).save(frames)
+        except Exception as e:
+            logger.warning("Could not write derived snapshot %r: %s", name, e)
+
+    def _full_sync(self):
+        started = time.time()
+        have_frames = self.frames is not None
+        content, validators = download_export(
+            self.data_url,
+            etag=self.validators.get("etag") if have_frames else None,
+            last_modified=self.validators.get("last_modified") if have_frames else None,
+        )
+        fingerprint = content_fingerprint(content) if content is not None else self.fingerprint
+        unchanged = have_frames and (content is None or fingerprint == self.fingerprint)
+
+        self.fingerprint = fingerprint
+        if not unchanged:
+            frames = parse_workbook(content, self.sheet_names)
+            self.watermark = _watermark_from(frames[0], started - VALIDATION_TS_MARGIN)
+            self.schema = None
+            self.last_changes = None
+            self._set_frames(frames)
+        self.validators = {k: v for k, v in validators.items() if v} or self.validators
+        self.last_full_sync = started
+        # An unchanged export (304 or same content hash) only refreshes the manifest, not the sheets
+        self._persist(metadata_only=unchanged)
+
+    def _incremental_sync(self):
+        asset_base = asset_api_base(self.data_url)
+        if self.schema is None:
+            self.schema = fetch_form_schema(asset_base)
+
+        records = fetch_submissions_since(asset_base, self.watermark)
+        if not records:
+            # Nothing new on the server: the persisted watermark is still the right place to resume from
+            return
+
+        main_sheet, females_sheet, preg_sheet = self.sheet_names
+        tables = flatten_submissions(records, main_sheet)
+        changed_uuids = {record.get(SUBMISSION_KEY) for record in records}
+
+        df_mortality, df_females, df_preg = self.frames
+        df_mortality = _upsert(
+            df_mortality, _rows_to_export_frame(tables[main_sheet], df_mortality, self.schema),
+            SUBMISSION_KEY, changed_uuids
+        )
+        df_females = _upsert(
+            df_females, _rows_to_export_frame(tables.get(females_sheet, []), df_females, self.schema),
+            CHILD_SUBMISSION_KEY, changed_uuids
+        )
+        df_preg = _upsert(
+            df_preg, _rows_to_export_frame(tables.get(preg_sheet, []), df_preg, self.schema),
+            CHILD_SUBMISSION_KEY, changed_uuids
+        )
+
+        # Only server-side validation timestamps move the watermark, so the local clock never skips a change
+        self.watermark = _watermark_from(
+            df_mortality, _newest_validation_ts(records, self.watermark.get("last_validation_ts"))
+        )
+        self.last_changes = (self.version, changed_uuids)
+        self._set_frames((df_mortality, df_females, df_preg))
+        self._persist()
+
+
+_SYNCS = {}
+_SYNCS_LOCK = threading.Lock()
+
+
+def shared_sync(data_url, main_sheet, females_sheet, preg_sheet):
+    """Return the one KoboSync for this asset in this process, so all sessions share its single flight."""
+    key = (data_url, main_sheet, females_sheet, preg_sheet)
+    with _SYNCS_LOCK:
+        if key not in _SYNCS:
+            _SYNCS[key] = KoboSync(data_url, main_sheet, females_sheet, preg_sheet)
+        return _SYNCS[key]
+
+
+# ---------------- BACKGROUND REFRESHER ----------------
+DataSnapshot = namedtuple("DataSnapshot", ["version", "frames", "as_of"])
+
+
+class BackgroundRefresher:
+    """Re-syncs one asset on a timer in a daemon thread and serves the last good snapshot.
+
+    On start the thread first publishes the on-disk snapshot, if there is one, and only then
+    revalidates it against Kobo, so a restart serves data without waiting on the network.
+    `prepare(frames, previous, changed)` runs in the thread before a new version is published, so
+    sessions only ever see fully processed data; publishing is a single attribute swap. When the
+    refresh follows a published version, `previous` is that version's prepared data (None on the first
+    publish) and, when the sync was incremental on top of it, `changed` the submission UUIDs touched
+    since (None after a full rebuild). A failed refresh keeps the previous snapshot and records the
+    error in `last_error`.
+
+    Published data is shared, read-only and held once per version: sessions keep just the
+    version id and resolve it with `get(version)`.
+    """
+
+    def __init__(self, sync, prepare=None, interval=REFRESH_INTERVAL):
+        self.sync = sync
+        self.prepare = prepare or (lambda frames, previous=None, changed=None: frames)
+        self.interval = interval
+        self.snapshot = None
+        self.last_error = None
+        self._published = OrderedDict()
+        self._wake = threading.Event()
+        self._ready = threading.Event()
+        self._thread = threading.Thread(target=self._run, name="kobo-refresher", daemon=True)
+        self._thread.start()
+
+    @property
+    def refreshing(self):
+        return self.sync._flight.in_flight()
+
+    def trigger(self):
+        """Start a refresh now instead of waiting for the next tick."""
+        self._wake.set()
+
+    def latest(self, timeout=None):
+        """Return the current DataSnapshot, waiting (up to timeout) only if none has been published yet."""
+        self._ready.wait(timeout)
+        return self.snapshot
+
+    def get(self, version):
+        """Return the DataSnapshot published under `version`, or None once it has been evicted."""
+        return self._published.get(version)
+
+    def _publish(self, snapshot):
+        self._published[snapshot.version] = snapshot
+        while len(self._published) > RETAINED_VERSIONS:
+            self._published.popitem(last=False)
+        self.snapshot = snapshot
+
+    def _run(self):
+        self._restore()
+        while True:
+            self._refresh()
+            self._wake.wait(self.interval)
+            self._wake.clear()
+
+    def _restore(self):
+        try:
+            frames = self.sync.restore()
+            if frames is not None:
+                as_of = datetime.fromtimestamp(self.sync.restored_at) if self.sync.restored_at else datetime.now()
+                self._publish(DataSnapshot(self.sync.version, self.prepare(frames, None, None), as_of))
+                self._ready.set()
+        except Exception as e:
+            logger.warning("Could not publish the Kobo snapshot from disk: %s", e)
+
+    def _refresh(self):
+        try:
+            frames = self.sync.sync()
+            current = self.snapshot
+            if current is not None and current.version == self.sync.version:
+                self._publish(current._replace(as_of=datetime.now()))
+            else:
+                previous = current.frames if current is not None else None
+                changed = None
+                changes = self.sync.last_changes
+                if current is not None and changes is not None and changes[0] == current.version:
+                    changed = changes[1]
+                prepared = self.prepare(frames, previous, changed)
+                self._publish(DataSnapshot(self.sync.version, prepared, datetime.now()))
+            self.last_error = None
+        except Exception as e:
+            logger.warning("Background Kobo refresh failed: %s", e)
+            self.last_error = e
+        finally:
+            self._ready.set()
+
+
+_REFRESHERS = {}
+
+
+def shared_refresher(sync, prepare=None, interval=REFRESH_INTERVAL):
+    """Return the one BackgroundRefresher for this sync, starting its thread on first use."""
+    with _SYNCS_LOCK:
+        if id(sync) not in _REFRESHERS:
+            _REFRESHERS[id(sync)] = BackgroundRefresher(sync, prepare, interval)
+        return _REFRESHERS[id(sync)]
@@ -0,0 +1,162 @@
+# ================================
+# SARMAAN II HEADLESS QC BATCH RUNNER
+# Runs the dashboard QC checks (qc_engine) on a Kobo export without Streamlit and writes
+# per-ward QC and coverage reports, e.g. nightly from cron:
+#   python qc_batch.py --config app.py --out qc_reports/cluster1
+#   python qc_batch.py --config supervisors.py --file export.xlsx --format csv parquet xlsx
+# Stage timings are printed as each stage finishes.
+# ================================
+
+import argparse
+import ast
+import os
+import re
+import time
+from contextlib import contextmanager
+
+from kobo_data import download_export, parse_workbook
+from qc_engine import (
+    ALL_WARDS, VALIDATION_COL, QCState, generate_coverage_scorecard, normalize_mortality, parse_sop_map,
+    parse_target_plan, render_qc_issues, resolve_schema,
+)
+
+# Constants read from the dashboard script named by --config
+DASHBOARD_CONSTANTS = ("DATA_URL", "MAIN_SHEET", "FEMALES_SHEET", "PREG_SHEET", "SOP_DATA", "TARGET_PLAN_DATA")
+REPORT_FORMATS = ("csv", "parquet", "xlsx")
+ALL_WARDS_NAME = "All_Wards"
+
+
+def read_dashboard_config(script_path):
+    """DATA_URL, sheet names, SOP and target plan of a dashboard script, read without running it."""
+    with open(script_path, encoding="utf-8") as f:
+        tree = ast.parse(f.read(), script_path)
+    config = {}
+    for node in tree.body:
+        if isinstance(node, ast.Assign) and len(node.targets) == 1 and isinstance(node.targets[0], ast.Name):
+            name = node.targets[0].id
+            if name in DASHBOARD_CONSTANTS:
+                config[name] = ast.literal_eval(node.value)
+    missing = [name for name in DASHBOARD_CONSTANTS if name not in config]
+    if missing:
+        raise ValueError(f"{script_path} does not define {', '.join(missing)}")
+    return config
+
+
+class StageTimer:
+    """Wall-clock time per named stage, printed as each stage finishes."""
+
+    def __init__(self):
+        self.timings = {}
+
+    @contextmanager
+    def stage(self, name):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - started
+            self.timings[name] = elapsed
+            print(f"[{name}] {elapsed:.2f}s", flush=True)
+
+
+def write_report(df, path_stem, formats):
+    for fmt in formats:
+        path = f"{path_stem}.{fmt}"
+        if fmt == "csv":
+            df.to_csv(path, index=False)
+        elif fmt == "parquet":
+            df.to_parquet(path, index=False)
+        elif fmt == "xlsx":
+            df.to_excel(path, index=False)
+
+
+def run_batch(config, source_file=None, data_url=None, out_dir="qc_reports", formats=("csv",), wards=None):
+    """Load one export, run QC and coverage, and write `<ward>_qc` / `<ward>_coverage` reports (plus All_Wards).
+
+    Returns the stage timings in seconds.
+    """
+    timer = StageTimer()
+    sheet_names = (config["MAIN_SHEET"], config["FEMALES_SHEET"], config["PREG_SHEET"])
+
+    with timer.stage("load"):
+        if source_file:
+            with open(source_file, "rb") as f:
+                content = f.read()
+        else:
+            content, _ = download_export(data_url or config["DATA_URL"])
+        df_mortality, df_females, df_preg = parse_workbook(content, sheet_names)
+
+    with timer.stage("prepare"):
+        df_mortality = normalize_mortality(df_mortality, parse_sop_map(config["SOP_DATA"]))
+        target_plan_df = parse_target_plan(config["TARGET_PLAN_DATA"])
+        schema = resolve_schema(df_mortality, df_females, df_preg)
+        WARD_COL = schema['ward'] or "Confirm your ward"
+        COMMUNITY_COL = schema['community'] or "Confirm your community"
+        UNIQUE_CODE_COL_RAW = schema['unique_code'] or 'unique_code'
+        # Same metric population as the dashboard: everything except 'Not Approved'
+        if VALIDATION_COL in df_mortality.columns:
+            df_for_metrics = df_mortality[df_mortality[VALIDATION_COL] != "Not Approved"].copy()
+            df_for_metrics[VALIDATION_COL] = df_for_metrics[VALIDATION_COL].astype(object).fillna("Validation Ongoing")
+        else:
+            df_for_metrics = df_mortality
+
+    with timer.stage("qc"):
+        qc_state = QCState.build(df_mortality, df_females, df_preg)
+
+    with timer.stage("coverage"):
+        coverage = generate_coverage_scorecard(
+            df_mortality, df_for_metrics, target_plan_df, WARD_COL, COMMUNITY_COL, UNIQUE_CODE_COL_RAW, VALIDATION_COL
+        )
+
+    with timer.stage("reports"):
+        report_wards = sorted(df_mortality[WARD_COL].dropna().unique()) if WARD_COL in df_mortality.columns else []
+        if wards:
+            report_wards = [ward for ward in report_wards if ward in wards]
+        report_cols = [col for col in ('_uuid', UNIQUE_CODE_COL_RAW, WARD_COL, COMMUNITY_COL, VALIDATION_COL) if col in df_for_metrics.columns]
+        submissions = df_for_metrics[report_cols].rename(columns={'_uuid': '_submission__uuid'})
+
+        reports = {}
+        for name, ward in [(ALL_WARDS_NAME, ALL_WARDS)] + [(ward, ward) for ward in report_wards]:
+            # Ward reports check duplicates within the ward, like a ward login on the dashboard
+            qc_df = qc_state.table(ward)
+            qc_df = qc_df[qc_df['_submission__uuid'].isin(submissions['_submission__uuid'])]
+            qc_df = qc_df.assign(QC_Issues=render_qc_issues(qc_df['QC_Flags'])).merge(
+                submissions, on='_submission__uuid', how='left'
+            )
+            ward_coverage = coverage if ward is ALL_WARDS or coverage.empty else coverage[coverage['Ward'] == ward]
+            reports[name] = (qc_df, ward_coverage)
+
+    with timer.stage("write"):
+        os.makedirs(out_dir, exist_ok=True)
+        for name, (qc_df, ward_coverage) in reports.items():
+            stem = os.path.join(out_dir, re.sub(r"[^\w.-]+", "_", str(name)))
+            write_report(qc_df, f"{stem}_qc", formats)
+            if not ward_coverage.empty:
+                write_report(ward_coverage, f"{stem}_coverage", formats)
+
+    print(
+        f"{len(df_mortality):,} submissions, {len(reports)} report scopes -> {out_dir} "
+        f"(total {sum(timer.timings.values()):.2f}s)",
+        flush=True,
+    )
+    return timer.timings
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Run the SARMAAN II QC checks headlessly and write per-ward reports.")
+    parser.add_argument("--config", default="app.py",
+                        help="dashboard script to take DATA_URL, sheet names, SOP and target plan from (read, not run)")
+    source = parser.add_mutually_exclusive_group()
+    source.add_argument("--file", help="local XLSX export to use instead of downloading")
+    source.add_argument("--url", help="export URL to download instead of the dashboard's DATA_URL")
+    parser.add_argument("--out", default="qc_reports", help="output directory (default: qc_reports)")
+    parser.add_argument("--format", nargs="+", choices=REPORT_FORMATS, default=["csv"], help="report formats")
+    parser.add_argument("--ward", nargs="+", help="only write reports for these wards (All_Wards is always written)")
+    args = parser.parse_args(argv)
+
+    config = read_dashboard_config(args.config)
+    run_batch(config, source_file=args.file, data_url=args.url, out_dir=args.out, formats=args.format, wards=args.ward)
+
+
+if __name__ == "__main__":
+    main()
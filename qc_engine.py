@@ -0,0 +1,1183 @@
+# ================================
+# SARMAAN II QC ENGINE (shared by the Cluster 1 / Cluster 2 dashboards)
+# IMPLEMENTS: Internal consistency + duplicate checks as flag columns / bitmask
+#             + declarative QC rule registry (QC_RULES), evaluated per table in one pass
+#             + incremental recomputation for new and changed submissions only
+#             + maintained hashed duplicate index (key -> submissions) per duplicate check
+#             + cross-cluster duplicate keys (Cluster 1 vs Cluster 2)
+#             + near-duplicate households (typo'd / swapped codes) via a blocking index
+#             + ward-partitioned execution of the ward-local checks on a process pool
+#             + per-version aggregate cube for the headline metrics
+#             + incrementally materialized daily coverage / QC trend
+#             + per-version cascading filter-option index for the sidebar
+#             + value -> row-position index for resolving sidebar selections in one pass
+#             + parent -> child row-range index for the female / pregnancy history sheets
+#             + schema resolver (logical field -> column), resolved once per data version
+# CRITICAL: Duplicate detection only considers 'Approved' and 'On Hold' (i.e. not 'Not Approved') records
+# ================================
+
+import logging
+import multiprocessing
+import os
+import threading
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from io import StringIO
+
+import numpy as np
+import pandas as pd
+
+logger = logging.getLogger(__name__)
+
+VALIDATION_COL = '_validation_status'
+# Stands in for a missing key: duplicated() treats missing values as equal to each other
+MISSING_KEY = "\x00<missing>"
+ALL_WARDS = None
+
+# ---------------- QC RULE REGISTRY ----------------
+# Sub-table columns the rules read, under logical names (values are resolve_qc_columns() keys);
+# a column missing from the export reads as the table's default.
+QC_FIELDS = {
+    "female": {"c_alive": "c_alive_col", "c_dead": "c_dead_col", "miscarriages": "miscarriage_col"},
+    "pregnancy": {"outcome": "outcome_col", "still_alive": "still_alive_col"},
+}
+QC_FIELD_DEFAULTS = {"female": 0, "pregnancy": np.nan}
+
+# Per-row column expressions (DataFrame.eval syntax), summed per submission. Every table's
+# measures are evaluated in a single pass, followed by one grouped sum.
+QC_MEASURES = {
+    "female": {
+        "women_alive": "c_alive",
+        "women_dead": "c_dead",
+        "women_miscarriages": "miscarriages",
+    },
+    "pregnancy": {
+        "born_alive": 'outcome == "Born Alive" and still_alive == "Yes"',
+        "later_died": 'still_alive == "No"',
+        "miscarriage_abortion": 'outcome == "Miscarriage and Abortion" or outcome == "Born dead"',
+    },
+}
+
+# QC rules, in QC_Issues order; a rule's bit in QC_Flags is its position here.
+#   consistency:    `expr` over the per-submission measures, True = flagged
+#   duplicate:      `key` (a resolve_qc_columns() key) shared by more than one Approved/On Hold row of `table`
+#   near_duplicate: see NearDuplicateIndex
+# `label` is the rule's QC_Issues text, `card_label` its QC summary card title.
+# Set "enabled": False to switch a rule off; Error_Percentage is out of the enabled rules.
+QC_RULES = {
+    "Born_Alive_Mismatch": {"label": "Born Alive mismatch", "card_label": "Born Alive Mismatch",
+                            "kind": "consistency", "expr": "women_alive != born_alive"},
+    "Miscarriage_Mismatch": {"label": "Miscarrage mismatch", "card_label": "Miscarriage Mismatch",
+                             "kind": "consistency", "expr": "women_miscarriages != miscarriage_abortion"},
+    "Later_Died_Mismatch": {"label": "Born Alive but Later Died mismatch", "card_label": "B.Alive, Later Died Mismatch",
+                            "kind": "consistency", "expr": "women_dead != later_died"},
+    "Duplicate_Household": {"label": "Duplicate Household", "card_label": "Duplicate Household",
+                            "kind": "duplicate", "table": "mortality", "key": "unique_code_col"},
+    "Duplicate_Mother": {"label": "Duplicate Mother", "card_label": "Duplicate Mother",
+                         "kind": "duplicate", "table": "female", "key": "mother_id_col"},
+    "Duplicate_Child": {"label": "Duplicate Child", "card_label": "Duplicate Child",
+                        "kind": "duplicate", "table": "pregnancy", "key": "child_id_col"},
+    "Near_Duplicate_Household": {"label": "Possible Duplicate Household", "card_label": "Possible Duplicate Household",
+                                 "kind": "near_duplicate"},
+}
+
+QC_FLAGS = {name: rule["label"] for name, rule in QC_RULES.items()}
+ACTIVE_RULES = [name for name, rule in QC_RULES.items() if rule.get("enabled", True)]
+CONSISTENCY_FLAGS = [name for name in ACTIVE_RULES if QC_RULES[name]["kind"] == "consistency"]
+DUPLICATE_FLAGS = [name for name in ACTIVE_RULES if QC_RULES[name]["kind"] == "duplicate"]
+
+# --- Near-duplicate households: only records in the same block are compared ---
+NEAR_DUPLICATE_BLOCK = ('ward_col', 'community_col', 'ra_col', 'date_col')
+# Codes this many edits apart (a typo, or two swapped neighbouring characters) with the same roster
+MAX_CODE_DISTANCE = 1
+
+# --- Schema: logical field -> (sheet, candidate headers in priority order) ---
+# Resolved once per data version by resolve_schema(); kobo_data prunes each sheet to the resolved columns.
+# For each candidate an exact header wins over one ending with it, which wins over one merely containing it,
+# so a short keyword like "name" only falls back to a substring hit when nothing better exists.
+SCHEMA_SHEETS = ("mortality", "females", "preg_history")
+SCHEMA_FIELDS = {
+    'ward': ("mortality", ("ward",)),
+    'lga': ("mortality", ("lga",)),
+    'community': ("mortality", ("community",)),
+    'ra': ("mortality", ("Type in your Name", "name")),
+    'unique_code': ("mortality", ("unique_code", "unique")),
+    'consent_date': ("mortality", ("consent_date",)),
+    'validation_comment': ("mortality", ("Validation Comment", "Justification")),
+    'c_alive': ("females", ("c_alive",)),
+    'c_dead': ("females", ("c_dead",)),
+    'boys_dead': ("females", ("boys have died",)),
+    'girls_dead': ("females", ("daughters have died",)),
+    'miscarriage': ("females", ("misscarraige",)),
+    'mother_id': ("females", ("mother_id",)),
+    'outcome': ("preg_history", ("Was the baby born alive",)),
+    'still_alive': ("preg_history", ("still alive",)),
+    'child_id': ("preg_history", ("child_id",)),
+}
+# Main-sheet label fields held as categoricals after load
+LABEL_FIELDS = ("ward", "lga", "community", "ra")
+
+# --- Parallel QC: ward-local checks run on a process pool for large exports ---
+QC_WORKERS = int(os.environ.get("QC_WORKERS", os.cpu_count() or 1))
+PARALLEL_MIN_SUBMISSIONS = 20000
+
+
+# ---------------- HELPER FUNCTIONS ----------------
+def match_column(columns, candidates):
+    """First header matching the candidates in order: exact, then ending with, then containing (all case-insensitive)."""
+    lowered = [(col, str(col).lower()) for col in columns if col is not None]
+    for candidate in candidates:
+        key = candidate.lower()
+        for matches in (key.__eq__, lambda header: header.endswith(key), lambda header: key in header):
+            for col, header in lowered:
+                if matches(header):
+                    return col
+    return None
+
+
+def resolve_field(df, field):
+    """Physical column of one SCHEMA_FIELDS field in `df` (None if the frame has no such column)."""
+    return match_column(df.columns, SCHEMA_FIELDS[field][1]) if df is not None else None
+
+
+def resolve_schema(df_mortality, df_females, df_preg_history):
+    """{logical field: physical column or None} for every SCHEMA_FIELDS field; resolve once per data version."""
+    frames = dict(zip(SCHEMA_SHEETS, (df_mortality, df_females, df_preg_history)))
+    return {field: resolve_field(frames[sheet], field) for field, (sheet, _) in SCHEMA_FIELDS.items()}
+
+
+def render_qc_issues(qc_flags):
+    """Turn QC_Flags bitmasks into the '; '-joined QC_Issues text (only call this for displayed rows)."""
+    labels = list(QC_FLAGS.values())
+    texts = {
+        mask: "; ".join(label for bit, label in enumerate(labels) if mask >> bit & 1) or "No Errors"
+        for mask in qc_flags.unique()
+    }
+    return qc_flags.map(texts)
+
+
+def parse_sop_map(sop_data):
+    """Community_ID -> settlement label from the tab-separated SOP table (empty if it doesn't parse)."""
+    try:
+        sop_df = pd.read_csv(StringIO(sop_data), sep='\t', skipinitialspace=True)
+        expected_columns = ['lga_Label', 'ward_Label', 'settlement_Label', 'Community_ID']
+        if list(sop_df.columns) == expected_columns:
+            return sop_df.set_index('Community_ID')['settlement_Label'].to_dict()
+        return {}
+    except Exception:
+        return {}
+
+
+def parse_target_plan(target_plan_data):
+    """The tab-separated community target plan with an integer Target_Plan column (empty if it doesn't parse)."""
+    try:
+        target_plan_df = pd.read_csv(StringIO(target_plan_data), sep='\t', skipinitialspace=True)
+        target_plan_df.columns = target_plan_df.columns.str.strip()
+        if 'Settlement Planned' in target_plan_df.columns:
+            target_plan_df.rename(columns={'Settlement Planned': 'Target_Plan'}, inplace=True)
+        target_plan_df['Target_Plan'] = pd.to_numeric(target_plan_df['Target_Plan'], errors='coerce').fillna(0).astype(int)
+        return target_plan_df
+    except Exception:
+        return pd.DataFrame()
+
+
+def normalize_mortality(df_mortality, sop_community_map):
+    """Load-time dtype fixes on a private copy of the main sheet, so reruns never re-parse or re-map:
+    parsed `start`, SOP community names, and the low-cardinality labels (LABEL_FIELDS, validation
+    status) as categoricals. Group by these with observed=True."""
+    df_mortality = df_mortality.copy()
+
+    if "start" in df_mortality.columns:
+        df_mortality["start"] = pd.to_datetime(df_mortality["start"], errors='coerce')
+
+    community_col = resolve_field(df_mortality, "community")
+    if community_col in df_mortality.columns and sop_community_map:
+        codes = df_mortality[community_col].astype(str)
+        df_mortality[community_col] = codes.map(sop_community_map).fillna(codes)
+
+    label_cols = [resolve_field(df_mortality, field) for field in LABEL_FIELDS] + [VALIDATION_COL]
+    for col in dict.fromkeys(label_cols):
+        if col in df_mortality.columns and df_mortality[col].dtype == object:
+            df_mortality[col] = df_mortality[col].astype("category")
+    return df_mortality
+
+
+def _keys(series):
+    return series.astype(object).where(series.notna(), MISSING_KEY)
+
+
+def _ensure_columns(df, *cols):
+    """Add any of `cols` the frame lacks (e.g. an empty sheet) as all-missing columns."""
+    missing = [col for col in cols if col not in df.columns]
+    return df.assign(**{col: pd.Series(dtype=object) for col in missing}) if missing else df
+
+
+def resolve_qc_columns(df_mortality, df_females, df_preg_history):
+    """Physical column of everything the QC checks read, from the resolved schema."""
+    schema = resolve_schema(df_mortality, df_females, df_preg_history)
+    return {
+        'outcome_col': schema['outcome'],
+        'still_alive_col': schema['still_alive'],
+        'boys_dead_col': schema['boys_dead'],
+        'girls_dead_col': schema['girls_dead'],
+        'c_alive_col': schema['c_alive'],
+        'c_dead_col': schema['c_dead'],
+        'miscarriage_col': schema['miscarriage'],
+        'unique_code_col': schema['unique_code'] or 'unique_code_col_not_found',
+        'ra_col': schema['ra'],
+        'mother_id_col': schema['mother_id'] or "mother_id",
+        'child_id_col': schema['child_id'] or "child_id",
+        'ward_col': schema['ward'],
+        'community_col': schema['community'],
+        'date_col': schema['consent_date'] or ('start' if 'start' in df_mortality.columns else None),
+    }
+
+
+def _measure_totals(df, table, columns):
+    """Evaluate the table's QC_MEASURES in one pass and sum them per submission UUID."""
+    fields = {
+        name: df[columns[key]] if columns[key] in df.columns else QC_FIELD_DEFAULTS[table]
+        for name, key in QC_FIELDS[table].items()
+    }
+    frame = pd.DataFrame(fields, index=df.index).assign(_submission__uuid=df['_submission__uuid'])
+    measures = QC_MEASURES[table]
+    frame = frame.eval("\n".join(f"{name} = {expr}" for name, expr in measures.items()), engine="python")
+    return frame.groupby('_submission__uuid')[list(measures)].sum()
+
+
+def submission_checks(df_mortality, df_females, df_preg_history, columns):
+    """Per-submission consistency flags (+ Research_Assistant and ward), indexed by submission UUID.
+
+    Every row depends only on that submission's own female/pregnancy rows, so this can be run
+    on any subset of submissions.
+    """
+    female_measures = _measure_totals(df_females, "female", columns)
+    preg_measures = _measure_totals(df_preg_history, "pregnancy", columns)
+    merged = female_measures.join(preg_measures, how="left").fillna(0).astype(int)
+
+    # Internal Consistency Errors: every rule expression in one pass over all submissions
+    if CONSISTENCY_FLAGS:
+        checks = merged.eval(
+            "\n".join(f"{name} = {QC_RULES[name]['expr']}" for name in CONSISTENCY_FLAGS), engine="python"
+        )[CONSISTENCY_FLAGS]
+    else:
+        checks = pd.DataFrame(index=merged.index)
+    checks.index = checks.index.to_numpy()
+
+    ra_col, ward_col = columns['ra_col'], columns['ward_col']
+    if ra_col and ra_col in df_mortality.columns:
+        ra_of_submission = dict(zip(df_mortality['_uuid'], df_mortality[ra_col]))
+        checks["Research_Assistant"] = checks.index.map(ra_of_submission)
+    else:
+        checks["Research_Assistant"] = np.nan
+    if ward_col and ward_col in df_mortality.columns:
+        ward_of_submission = dict(zip(df_mortality['_uuid'], _keys(df_mortality[ward_col])))
+        checks["_ward"] = pd.Series(checks.index.map(ward_of_submission), index=checks.index).fillna(MISSING_KEY)
+    else:
+        checks["_ward"] = MISSING_KEY
+    return checks
+
+
+def duplicate_key_rows(df_mortality, df_females, df_preg_history, columns):
+    """Rows taking part in the Household / Mother / Child duplicate checks, as (uuid, ward, key).
+
+    CRITICAL: only rows belonging to Approved/On Hold submissions are returned.
+    """
+    # Filter out "Not Approved" records BEFORE checking for duplicates
+    if VALIDATION_COL in df_mortality.columns:
+        df_mortality_for_dupe_check = df_mortality[df_mortality[VALIDATION_COL] != "Not Approved"]
+    else:
+        # If validation column doesn't exist, use all records
+        df_mortality_for_dupe_check = df_mortality
+
+    ward_col = columns['ward_col']
+    if ward_col and ward_col in df_mortality_for_dupe_check.columns:
+        wards = _keys(df_mortality_for_dupe_check[ward_col])
+    else:
+        wards = pd.Series(MISSING_KEY, index=df_mortality_for_dupe_check.index)
+    ward_of_submission = dict(zip(df_mortality_for_dupe_check['_uuid'], wards))
+
+    def key_rows(df, uuid_col, key_col, ward_series=None):
+        if key_col not in df.columns:
+            return pd.DataFrame({"_submission__uuid": [], "_ward": [], "_key": []})
+        if ward_series is None:
+            # Filter females and pregnancy history to ONLY include approved/on-hold records (one lookup pass)
+            ward_series = df[uuid_col].map(ward_of_submission)
+            df, ward_series = df[ward_series.notna()], ward_series[ward_series.notna()]
+        return pd.DataFrame({
+            "_submission__uuid": df[uuid_col].to_numpy(),
+            "_ward": ward_series.to_numpy(),
+            "_key": _keys(df[key_col]).to_numpy(),
+        })
+
+    tables = {
+        "mortality": (df_mortality_for_dupe_check, '_uuid', wards),
+        "female": (df_females, '_submission__uuid', None),
+        "pregnancy": (df_preg_history, '_submission__uuid', None),
+    }
+    rows = {}
+    for flag in DUPLICATE_FLAGS:
+        df, uuid_col, ward_series = tables[QC_RULES[flag]["table"]]
+        rows[flag] = key_rows(df, uuid_col, columns[QC_RULES[flag]["key"]], ward_series)
+    return rows
+
+
+# ---------------- DUPLICATE INDEX ----------------
+class DuplicateIndex:
+    """Hashed duplicate index for one key column: key -> {submission UUID: rows}, overall and per ward.
+
+    The set of submissions whose key collides with another row is maintained as rows are added and
+    removed, so "which submissions are duplicates" and "who collides with this record" are dict
+    lookups rather than a duplicated() scan. `updated()` returns a new index and leaves this one
+    untouched (it may still be serving the previous data version).
+    """
+
+    def __init__(self):
+        self._entries = {}     # uuid -> (ward, {key: rows})
+        self._members = {}     # scope -> {key: {uuid: rows}}
+        self._duplicates = {}  # scope -> Counter(uuid -> rows whose key collides)
+        self._owned = None     # (scope, key) member maps safe to mutate; None = all of them
+
+    @classmethod
+    def from_rows(cls, rows):
+        """Index built from (_submission__uuid, _ward, _key) rows, as returned by duplicate_key_rows()."""
+        index = cls()
+        grouped = rows.groupby(["_submission__uuid", "_ward", "_key"], sort=False).size().reset_index(name="_rows")
+        entries, members = index._entries, index._members
+        for uuid, ward, key, n in zip(*(grouped[col].tolist() for col in grouped.columns)):
+            entry = entries.get(uuid)
+            if entry is None:
+                entry = entries[uuid] = (ward, {})
+            entry[1][key] = n
+            for scope in (ALL_WARDS, ward):
+                scope_members = members.get(scope)
+                if scope_members is None:
+                    scope_members = members[scope] = {}
+                holders = scope_members.get(key)
+                if holders is None:
+                    scope_members[key] = {uuid: n}
+                else:
+                    holders[uuid] = n
+
+        # Colliding rows per submission, for all wards and within each ward
+        everywhere = grouped[grouped.groupby("_key")["_rows"].transform("sum") > 1]
+        index._duplicates[ALL_WARDS] = Counter(everywhere.groupby("_submission__uuid")["_rows"].sum().to_dict())
+        within_ward = grouped[grouped.groupby(["_ward", "_key"])["_rows"].transform("sum") > 1]
+        for ward, ward_rows in within_ward.groupby("_ward"):
+            index._duplicates[ward] = Counter(ward_rows.groupby("_submission__uuid")["_rows"].sum().to_dict())
+        return index
+
+    def updated(self, removed_uuids, rows):
+        """New index with every row of `removed_uuids` dropped and `rows` added."""
+        index = DuplicateIndex()
+        index._entries = dict(self._entries)
+        index._members = {scope: dict(members) for scope, members in self._members.items()}
+        index._duplicates = {scope: Counter(uuids) for scope, uuids in self._duplicates.items()}
+        index._owned = set()
+        for uuid in removed_uuids:
+            index._remove_submission(uuid)
+        index._add_rows(rows)
+        return index
+
+    # --- queries ---
+    def duplicate_submissions(self, ward=ALL_WARDS):
+        """Set-like view of the submissions with at least one colliding key (within `ward` if given)."""
+        return self._duplicates.get(ward, Counter()).keys()
+
+    def keys(self):
+        """Set-like view of every indexed key (all wards)."""
+        return self._members.get(ALL_WARDS, {}).keys()
+
+    def holders(self, key):
+        """Submission UUIDs holding `key` (all wards)."""
+        return list(self._members.get(ALL_WARDS, {}).get(key, ()))
+
+    def is_duplicate(self, uuid, ward=ALL_WARDS):
+        return uuid in self._duplicates.get(ward, ())
+
+    def collisions(self, uuid, ward=ALL_WARDS):
+        """{key: [other submission UUIDs sharing it]} for this submission's colliding keys."""
+        entry = self._entries.get(uuid)
+        if entry is None or (ward is not ALL_WARDS and entry[0] != ward):
+            return {}
+        members = self._members.get(ward, {})
+        result = {}
+        for key in entry[1]:
+            holders = members.get(key, {})
+            if sum(holders.values()) > 1:
+                result[key] = [other for other in holders if other != uuid]
+        return result
+
+    def duplicates_among(self, uuids):
+        """The submissions in `uuids` whose key collides with another row of those same submissions."""
+        everywhere = self._duplicates.get(ALL_WARDS, ())
+        candidates = [uuid for uuid in dict.fromkeys(uuids) if uuid in everywhere]
+        key_rows = Counter()
+        for uuid in candidates:
+            key_rows.update(self._entries[uuid][1])
+        return {
+            uuid for uuid in candidates
+            if any(key_rows[key] > 1 for key in self._entries[uuid][1])
+        }
+
+    # --- maintenance ---
+    def _add_rows(self, rows):
+        grouped = rows.groupby(["_submission__uuid", "_ward", "_key"], sort=False).size()
+        for (uuid, ward, key), n in grouped.items():
+            entry = self._entries.get(uuid)
+            keys = {} if entry is None or entry[0] != ward else dict(entry[1])
+            keys[key] = keys.get(key, 0) + n
+            entry = (ward, keys)
+            self._entries[uuid] = entry
+            for scope in (ALL_WARDS, ward):
+                self._add(scope, key, uuid, n)
+
+    def _remove_submission(self, uuid):
+        entry = self._entries.pop(uuid, None)
+        if entry is None:
+            return
+        ward, keys = entry
+        for key, n in keys.items():
+            for scope in (ALL_WARDS, ward):
+                self._remove(scope, key, uuid, n)
+
+    def _holders(self, scope, key):
+        """The scope's {uuid: rows} map for `key`, copied first if still shared with another index."""
+        members = self._members.setdefault(scope, {})
+        holders = members.get(key)
+        if holders is None:
+            holders = members[key] = {}
+        elif self._owned is not None and (scope, key) not in self._owned:
+            holders = members[key] = dict(holders)
+        if self._owned is not None:
+            self._owned.add((scope, key))
+        return holders
+
+    def _add(self, scope, key, uuid, n):
+        holders = self._holders(scope, key)
+        before = sum(holders.values())
+        holders[uuid] = holders.get(uuid, 0) + n
+        duplicates = self._duplicates.setdefault(scope, Counter())
+        if before > 1:
+            duplicates[uuid] += n
+        elif before + n > 1:
+            # The key just started colliding: every holder becomes a duplicate
+            duplicates.update(holders)
+
+    def _remove(self, scope, key, uuid, n):
+        holders = self._holders(scope, key)
+        before = sum(holders.values())
+        duplicates = self._duplicates.setdefault(scope, Counter())
+        if before > 1:
+            touched = list(holders) if before - n <= 1 else [uuid]
+            if before - n > 1:
+                duplicates[uuid] -= n
+            else:
+                # The key no longer collides: nobody holding it is a duplicate because of it
+                duplicates.subtract(holders)
+            for other in touched:
+                if duplicates[other] <= 0:
+                    del duplicates[other]
+        holders[uuid] -= n
+        if holders[uuid] <= 0:
+            del holders[uuid]
+        if not holders:
+            del self._members[scope][key]
+
+
+def build_duplicate_indexes(df_mortality, df_females, df_preg_history):
+    """A DuplicateIndex per duplicate check over the whole export: all a peer cluster needs for CrossClusterIndex."""
+    df_mortality = _ensure_columns(df_mortality, '_uuid')
+    df_females = _ensure_columns(df_females, '_submission__uuid')
+    df_preg_history = _ensure_columns(df_preg_history, '_submission__uuid')
+    columns = resolve_qc_columns(df_mortality, df_females, df_preg_history)
+    dupe_rows = duplicate_key_rows(df_mortality, df_females, df_preg_history, columns)
+    return {flag: DuplicateIndex.from_rows(rows) for flag, rows in dupe_rows.items()}
+
+
+class CrossClusterIndex:
+    """Keys shared between clusters, found by intersecting each cluster's DuplicateIndex key sets.
+
+    Nothing is concatenated or re-scanned: every pair of clusters costs one hash-set intersection
+    per duplicate check (sized by the smaller cluster). Missing keys never count as a match.
+    `indexes` maps cluster -> {check: DuplicateIndex} (QCState.duplicate_indexes or build_duplicate_indexes()).
+    """
+
+    def __init__(self, indexes):
+        # Check -> key -> clusters holding it, for keys held by more than one cluster
+        self.shared_keys = {flag: {} for flag in DUPLICATE_FLAGS}
+        self.indexes = dict(indexes)
+        clusters = list(self.indexes)
+        for flag in DUPLICATE_FLAGS:
+            for i, cluster in enumerate(clusters):
+                for other in clusters[i + 1:]:
+                    keys, other_keys = self.indexes[cluster][flag].keys(), self.indexes[other][flag].keys()
+                    smaller, larger = sorted((keys, other_keys), key=len)
+                    for key in smaller & larger:
+                        if key != MISSING_KEY:
+                            self.shared_keys[flag].setdefault(key, set()).update((cluster, other))
+
+    def table(self, cluster):
+        """One row per (submission of `cluster`, check, key) that also occurs in another cluster."""
+        rows = []
+        for flag, keys in self.shared_keys.items():
+            index = self.indexes[cluster][flag]
+            for key, clusters in keys.items():
+                if cluster not in clusters:
+                    continue
+                others = ", ".join(sorted(clusters - {cluster}))
+                for uuid in index.holders(key):
+                    rows.append((uuid, QC_FLAGS[flag], key, others))
+        return pd.DataFrame(rows, columns=["_submission__uuid", "Check", "Key", "Other_Clusters"])
+
+
+# ---------------- NEAR-DUPLICATE HOUSEHOLDS ----------------
+def normalize_code(code):
+    """Upper-case alphanumerics only, so 'hh-012 ' and 'HH012' compare equal."""
+    return "".join(ch for ch in str(code).upper() if ch.isalnum())
+
+
+def code_distance(a, b, limit):
+    """Edit distance counting a swap of neighbouring characters as one edit; stops at limit + 1."""
+    if abs(len(a) - len(b)) > limit:
+        return limit + 1
+    previous, current = None, list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        before_previous, previous, current = previous, current, [i] + [0] * len(b)
+        for j in range(1, len(b) + 1):
+            cost = a[i - 1] != b[j - 1]
+            current[j] = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            if i > 1 and j > 1 and a[i - 1] == b[j - 2] and a[i - 2] == b[j - 1]:
+                current[j] = min(current[j], before_previous[j - 2] + 1)
+        # A swap reaches back two rows, so stop only once two consecutive rows are over the limit
+        if min(current) > limit and min(previous) > limit:
+            return limit + 1
+    return min(current[-1], limit + 1)
+
+
+def near_duplicate_records(df_mortality, df_females, columns, female_index=None):
+    """Households taking part in the near-duplicate check, indexed by submission UUID.
+
+    Columns: _block (ward, community, RA, date), _code, _normalized and _roster (women listed,
+    children alive, children dead) from the female sheet. Not Approved submissions and missing
+    codes are left out. `female_index` is an optional ChildIndex over df_females, used to gather
+    the eligible submissions' women instead of scanning the sheet.
+    """
+    code_col = columns['unique_code_col']
+    if code_col not in df_mortality.columns:
+        return pd.DataFrame(columns=["_block", "_code", "_normalized", "_roster"])
+    eligible = df_mortality[df_mortality[code_col].notna()]
+    if VALIDATION_COL in eligible.columns:
+        eligible = eligible[eligible[VALIDATION_COL] != "Not Approved"]
+
+    block_parts = []
+    for name in NEAR_DUPLICATE_BLOCK:
+        col = columns[name]
+        if col is None or col not in eligible.columns:
+            block_parts.append([MISSING_KEY] * len(eligible))
+        elif name == 'date_col':
+            dates = pd.to_datetime(eligible[col], errors='coerce').dt.strftime('%Y-%m-%d')
+            block_parts.append(_keys(dates).tolist())
+        else:
+            block_parts.append(_keys(eligible[col]).tolist())
+
+    roster_cols = [columns[name] for name in ('c_alive_col', 'c_dead_col')]
+    roster_cols = [col for col in roster_cols if col and col in df_females.columns]
+    if female_index is not None:
+        females = df_females.iloc[female_index.rows(eligible['_uuid'])]
+    else:
+        females = df_females[df_females['_submission__uuid'].isin(eligible['_uuid'])]
+    roster = females.groupby('_submission__uuid').agg(
+        _women=('_submission__uuid', 'size'),
+        **{f"_{i}": (col, 'sum') for i, col in enumerate(roster_cols)}
+    )
+    roster_of_submission = dict(zip(roster.index, map(tuple, roster.to_numpy().tolist())))
+
+    records = pd.DataFrame({
+        "_block": list(zip(*block_parts)) if len(eligible) else [],
+        "_code": eligible[code_col].astype(str).to_numpy(),
+        "_normalized": [normalize_code(code) for code in eligible[code_col]],
+        "_roster": [roster_of_submission.get(uuid, ()) for uuid in eligible['_uuid']],
+    }, index=eligible['_uuid'].to_numpy())
+    return records[records["_normalized"] != ""]
+
+
+def _near_duplicates(a, b):
+    """Same household written two ways: same normalized code, or one edit apart with the same roster."""
+    _, code_a, normalized_a, roster_a = a
+    _, code_b, normalized_b, roster_b = b
+    if code_a == code_b:
+        # Exact matches are already reported as Duplicate Household
+        return False
+    if normalized_a == normalized_b:
+        return True
+    return roster_a == roster_b and code_distance(normalized_a, normalized_b, MAX_CODE_DISTANCE) <= MAX_CODE_DISTANCE
+
+
+class NearDuplicateIndex:
+    """Blocking index for near-duplicate households: block -> submissions, plus each submission's matches.
+
+    Records are only compared with the others in their block, so the work grows with block sizes
+    rather than the square of the export. `updated()` re-compares only the blocks that gained or
+    lost a submission and leaves this index untouched.
+    """
+
+    def __init__(self):
+        self._records = {}   # uuid -> (block, code, normalized code, roster)
+        self._blocks = {}    # block -> tuple of uuids
+        self._matches = {}   # uuid -> frozenset of near-duplicate uuids (only non-empty ones)
+
+    @classmethod
+    def from_records(cls, records):
+        """Index built from near_duplicate_records() output."""
+        index = cls()
+        index._add_records(records)
+        for block in index._blocks:
+            index._compare_block(block)
+        return index
+
+    def updated(self, removed_uuids, records):
+        """New index with `removed_uuids` dropped and `records` added."""
+        index = NearDuplicateIndex()
+        index._records = dict(self._records)
+        index._blocks = dict(self._blocks)
+        index._matches = dict(self._matches)
+        touched = set()
+        for uuid in removed_uuids:
+            record = index._records.pop(uuid, None)
+            index._matches.pop(uuid, None)
+            if record is not None:
+                block = record[0]
+                touched.add(block)
+                index._blocks[block] = tuple(other for other in index._blocks[block] if other != uuid)
+        touched.update(index._add_records(records))
+        for block in touched:
+            if not index._blocks.get(block):
+                index._blocks.pop(block, None)
+            else:
+                index._compare_block(block)
+        return index
+
+    def flagged(self):
+        """Set-like view of the submissions with at least one near-duplicate."""
+        return self._matches.keys()
+
+    def matches(self, uuid):
+        """Submission UUIDs that look like the same household as `uuid`."""
+        return self._matches.get(uuid, frozenset())
+
+    @classmethod
+    def merged(cls, indexes):
+        """One index from indexes over disjoint sets of blocks (e.g. one per ward)."""
+        index = cls()
+        for part in indexes:
+            index._records.update(part._records)
+            index._blocks.update(part._blocks)
+            index._matches.update(part._matches)
+        return index
+
+    def _add_records(self, records):
+        blocks = set()
+        for uuid, record in zip(records.index, records.itertuples(index=False, name=None)):
+            block = record[0]
+            self._records[uuid] = record
+            self._blocks[block] = self._blocks.get(block, ()) + (uuid,)
+            blocks.add(block)
+        return blocks
+
+    def _compare_block(self, block):
+        members = self._blocks[block]
+        matches = {uuid: set() for uuid in members}
+        for i, uuid in enumerate(members):
+            record = self._records[uuid]
+            for other in members[i + 1:]:
+                if _near_duplicates(record, self._records[other]):
+                    matches[uuid].add(other)
+                    matches[other].add(uuid)
+        for uuid, found in matches.items():
+            if found:
+                self._matches[uuid] = frozenset(found)
+            else:
+                self._matches.pop(uuid, None)
+
+
+# ---------------- COVERAGE SCORECARD ----------------
+def generate_coverage_scorecard(df_mortality_full, df_mortality_for_metrics, target_plan_df, ward_col, community_col, unique_code_col, validation_col):
+    """Generate a Community Coverage Scorecard comparing target plans with actual submissions.
+
+    One grouped count per (ward, community, Not Approved?) over all submissions and one per
+    (ward, community) over the metric rows, joined to the target plan.
+    """
+    
+    if target_plan_df.empty or community_col not in df_mortality_full.columns or ward_col not in df_mortality_full.columns:
+        return pd.DataFrame()
+    
+    keys = [ward_col, community_col]
+
+    if validation_col in df_mortality_full.columns:
+        not_approved = df_mortality_full[validation_col] == "Not Approved"
+    else:
+        not_approved = pd.Series(False, index=df_mortality_full.index)
+    by_status = df_mortality_full.groupby(keys + [not_approved.rename('_not_approved')], observed=True).size().unstack(fill_value=0)
+    submissions = pd.DataFrame({
+        'Total Submissions': by_status.sum(axis=1),
+        'Not Approved': by_status[True] if True in by_status.columns else 0,
+    })
+    submissions['Approved Record'] = df_mortality_for_metrics.groupby(keys, observed=True).size()
+    return _scorecard_from_counts(target_plan_df, submissions)
+
+
+def cube_coverage_scorecard(cube, metrics_cube, target_plan_df, ward_col, community_col, validation_col):
+    """generate_coverage_scorecard() summed from aggregate cubes (all submissions / metric rows) instead of raw rows."""
+    if target_plan_df.empty or community_col not in cube.columns or ward_col not in cube.columns:
+        return pd.DataFrame()
+
+    keys = [ward_col, community_col]
+    if validation_col in cube.columns:
+        not_approved = cube['Submissions'].where(cube[validation_col] == "Not Approved", 0)
+    else:
+        not_approved = cube['Submissions'] * 0
+    submissions = pd.DataFrame({
+        'Total Submissions': cube.groupby(keys, observed=True)['Submissions'].sum(),
+        'Not Approved': not_approved.groupby([cube[key] for key in keys], observed=True).sum(),
+    })
+    submissions['Approved Record'] = metrics_cube.groupby(keys, observed=True)['Submissions'].sum()
+    return _scorecard_from_counts(target_plan_df, submissions)
+
+
+def _scorecard_from_counts(target_plan_df, submissions):
+    """Join (ward, community)-indexed submission counts to the target plan."""
+    scorecard_df = pd.DataFrame({
+        'Ward': target_plan_df['ward'].str.strip(),
+        'Community': target_plan_df['community'].str.strip(),
+        'Target Plan': target_plan_df['Target_Plan'] if 'Target_Plan' in target_plan_df.columns else 0,
+    })
+    submissions.index.names = ['Ward', 'Community']
+
+    scorecard_df = scorecard_df.merge(submissions.reset_index(), on=['Ward', 'Community'], how='left')
+    counts = ['Total Submissions', 'Approved Record', 'Not Approved']
+    scorecard_df[counts] = scorecard_df[counts].fillna(0).astype(int)
+    scorecard_df['Target Plan'] = scorecard_df['Target Plan'].astype(int)
+    scorecard_df['Outstanding'] = (scorecard_df['Target Plan'] - scorecard_df['Approved Record']).clip(lower=0)
+
+    scorecard_df = scorecard_df[['Ward', 'Community', 'Target Plan', 'Total Submissions', 'Approved Record', 'Not Approved', 'Outstanding']]
+    scorecard_df = scorecard_df.sort_values(by=['Ward', 'Community']).reset_index(drop=True)
+    
+    return scorecard_df
+
+
+# ---------------- AGGREGATE CUBE ----------------
+CUBE_DATE = "_date"
+CUBE_MEASURES = ["Submissions", "QC_Submissions", *QC_FLAGS, "Total_Flags"]
+
+
+def build_aggregate_cube(df_mortality, qc_df, dim_cols, date_col=None):
+    """Submission and QC flag counts per combination of `dim_cols` and collection date (CUBE_DATE).
+
+    Missing dimension values are kept as their own group, so any filter combination can be answered
+    by slicing and summing the cube. QC_Submissions counts the submissions present in `qc_df`.
+    """
+    dims = [col for col in dict.fromkeys(dim_cols) if col in df_mortality.columns]
+    cube = df_mortality[dims]
+    if date_col in df_mortality.columns:
+        cube = cube.assign(**{CUBE_DATE: pd.to_datetime(df_mortality[date_col], errors='coerce').dt.date})
+        dims.append(CUBE_DATE)
+
+    qc_of_submission = qc_df.set_index('_submission__uuid')[list(QC_FLAGS) + ['Total_Flags']]
+    qc_of_submission = qc_of_submission.reindex(df_mortality['_uuid'])
+    cube = cube.assign(
+        Submissions=1,
+        QC_Submissions=qc_of_submission['Total_Flags'].notna().to_numpy().astype(int),
+        **{col: qc_of_submission[col].fillna(0).to_numpy().astype(int) for col in qc_of_submission.columns},
+    )
+    if not dims:
+        return cube[CUBE_MEASURES].sum().to_frame().T
+    return cube.groupby(dims, dropna=False, sort=False, observed=True)[CUBE_MEASURES].sum().reset_index()
+
+
+def slice_cube(cube, selections):
+    """Cube rows matching every {column: value} selection."""
+    mask = np.ones(len(cube), dtype=bool)
+    for col, value in selections.items():
+        mask &= (cube[col] == value).to_numpy()
+    return cube[mask]
+
+
+class ChildIndex:
+    """Row range of each submission in a child sheet (female / pregnancy history) whose rows are grouped by
+    `_submission__uuid`, so the children of a set of submissions are a gather instead of an isin scan."""
+
+    def __init__(self, submission_uuids):
+        codes, uniques = pd.factorize(pd.Series(submission_uuids))
+        self.size = len(codes)
+        starts = np.flatnonzero(np.r_[True, codes[1:] != codes[:-1]]) if self.size else np.empty(0, dtype=np.intp)
+        stops = np.r_[starts[1:], self.size].astype(np.intp)
+        keep = codes[starts] >= 0 if self.size else np.empty(0, dtype=bool)
+        self._uuids = pd.Index(uniques.take(codes[starts[keep]]))
+        if not self._uuids.is_unique:
+            raise ValueError("child rows must be grouped by _submission__uuid")
+        self._starts, self._stops = starts[keep], stops[keep]
+
+    def rows(self, uuids):
+        """Ascending positions of the child rows of `uuids` (submissions without children have none)."""
+        found = self._uuids.get_indexer(pd.unique(pd.Series(uuids, dtype=object)))
+        found = found[found >= 0]
+        starts, lengths = self._starts[found], self._stops[found] - self._starts[found]
+        rows = np.repeat(starts - np.cumsum(lengths) + lengths, lengths) + np.arange(lengths.sum())
+        return np.sort(rows)
+
+
+class FilterOptions:
+    """Cascading sidebar options (ward -> LGA -> community -> RA -> date), each level narrowed by the
+    selections above it. Read from the distinct dim combinations of an aggregate cube, never the raw rows,
+    and memoized per selection path."""
+
+    def __init__(self, cube, levels):
+        self.levels = [col for col in levels if col in cube.columns]
+        self._combos = cube[self.levels].drop_duplicates()
+        self._options = {}
+
+    def options(self, col, selections=None):
+        """Sorted non-missing values of `col` among the combinations matching {column: value} selections."""
+        selections = selections or {}
+        key = (col, tuple(selections.items()))
+        if key not in self._options:
+            values = slice_cube(self._combos, selections)[col].dropna().unique()
+            self._options[key] = sorted(values)
+        return self._options[key]
+
+
+class RowIndex:
+    """Row positions of a frame per value of each filter column (dates under CUBE_DATE), so a sidebar
+    selection is resolved as one intersection of sorted position arrays instead of chained boolean copies."""
+
+    def __init__(self, df, cols, date_col=None):
+        self.size = len(df)
+        self._positions = {
+            col: df.groupby(col, sort=False, observed=True).indices for col in dict.fromkeys(cols) if col in df.columns
+        }
+        if date_col in df.columns:
+            days = pd.to_datetime(df[date_col], errors='coerce').dt.date
+            self._positions[CUBE_DATE] = days.groupby(days, sort=False).indices
+
+    def rows(self, selections, exclude=None):
+        """Ascending positions of the rows matching every {column: value} selection and none of `exclude`."""
+        empty = np.empty(0, dtype=np.intp)
+        rows = None
+        for col, value in selections.items():
+            hits = self._positions[col].get(value, empty)
+            rows = hits if rows is None else np.intersect1d(rows, hits, assume_unique=True)
+        if rows is None:
+            rows = np.arange(self.size)
+        for col, value in (exclude or {}).items():
+            if col in self._positions:
+                rows = np.setdiff1d(rows, self._positions[col].get(value, empty), assume_unique=True)
+        return rows
+
+
+# ---------------- DAILY TREND ----------------
+TREND_DATE = "_date"
+TREND_MEASURES = ["Approved Records", "Flagged Records", "Total_Flags", "Ward Flagged Records", "Ward Total_Flags"]
+# Measure -> its counterpart with duplicates checked within the submission's own ward (what a ward login sees)
+WARD_TREND_MEASURES = {"Flagged Records": "Ward Flagged Records", "Total_Flags": "Ward Total_Flags"}
+
+
+def trend_contributions(df_mortality, qc_df, dim_cols, date_col, ward_qc_df=None):
+    """What each submission adds to the daily trend: its day and dim values (MISSING_KEY when blank) plus
+    Approved Records / Flagged Records / Total_Flags, counting only submissions that are not 'Not Approved'.
+    The Ward measures take their flags from `ward_qc_df` (QCState.ward_table()), or from qc_df if not given."""
+    dims = [col for col in dict.fromkeys(dim_cols) if col in df_mortality.columns]
+    if date_col in df_mortality.columns:
+        days = pd.to_datetime(df_mortality[date_col], errors='coerce').dt.strftime('%Y-%m-%d')
+    else:
+        days = pd.Series(np.nan, index=df_mortality.index)
+    if VALIDATION_COL in df_mortality.columns:
+        counted = (df_mortality[VALIDATION_COL] != "Not Approved").to_numpy()
+    else:
+        counted = np.ones(len(df_mortality), dtype=bool)
+    def flags_of(qc):
+        return qc.set_index('_submission__uuid')['Total_Flags'].reindex(df_mortality['_uuid']).fillna(0).to_numpy()
+
+    total_flags = flags_of(qc_df)
+    ward_flags = flags_of(ward_qc_df) if ward_qc_df is not None else total_flags
+
+    contributions = pd.DataFrame(
+        {TREND_DATE: _keys(days).to_numpy(), **{col: _keys(df_mortality[col]).to_numpy() for col in dims}},
+        index=df_mortality['_uuid'].to_numpy(),
+    )
+    contributions["Approved Records"] = counted.astype(int)
+    contributions["Flagged Records"] = (counted & (total_flags > 0)).astype(int)
+    contributions["Total_Flags"] = np.where(counted, total_flags, 0).astype(int)
+    contributions["Ward Flagged Records"] = (counted & (ward_flags > 0)).astype(int)
+    contributions["Ward Total_Flags"] = np.where(counted, ward_flags, 0).astype(int)
+    return contributions[~contributions.index.duplicated(keep="last")]
+
+
+class DailyTrend:
+    """Per-day Approved / Flagged totals per (day, ward, LGA, community, RA), materialized incrementally.
+
+    `updated()` diffs the new per-submission contributions against the previous ones and only adds
+    or subtracts the submissions that moved (new, edited, re-validated, removed, or re-flagged), so
+    days nobody touched are never re-aggregated.
+    """
+
+    def __init__(self, contributions, daily):
+        self.contributions = contributions
+        self.daily = daily
+
+    @classmethod
+    def build(cls, contributions):
+        return cls(contributions, cls._totals(contributions))
+
+    def to_frames(self):
+        """(contributions, daily) as flat frames, for storing next to the data snapshot."""
+        return self.contributions.rename_axis("_submission__uuid").reset_index(), self.daily.reset_index()
+
+    @classmethod
+    def from_frames(cls, contributions, daily):
+        """Inverse of to_frames()."""
+        keys = [col for col in daily.columns if col not in TREND_MEASURES]
+        return cls(contributions.set_index("_submission__uuid").rename_axis(None), daily.set_index(keys))
+
+    @staticmethod
+    def _totals(contributions):
+        keys = [col for col in contributions.columns if col not in TREND_MEASURES]
+        totals = contributions.groupby(keys)[TREND_MEASURES].sum()
+        return totals[(totals != 0).any(axis=1)]
+
+    def updated(self, contributions):
+        old, new = self.contributions, contributions
+        if list(old.columns) != list(new.columns):
+            return DailyTrend.build(new)
+
+        common = old.index.intersection(new.index)
+        moved = common[(old.loc[common].to_numpy() != new.loc[common].to_numpy()).any(axis=1)]
+        removed = old.index.difference(new.index).union(moved)
+        added = new.index.difference(old.index).union(moved)
+        if removed.empty and added.empty:
+            return DailyTrend(new, self.daily)
+
+        delta = pd.concat([
+            self._totals(new.loc[added]),
+            -self._totals(old.loc[removed]),
+        ])
+        daily = self.daily.add(delta.groupby(level=list(range(delta.index.nlevels))).sum(), fill_value=0)
+        daily = daily[(daily[TREND_MEASURES] != 0).any(axis=1)].astype(int).sort_index()
+        return DailyTrend(new, daily)
+
+    def series(self, selections=None, ward_scope=False):
+        """Per-day and cumulative totals (indexed by day) over the rows matching {dim column: value} selections.
+        With ward_scope the flag measures count duplicates within each submission's ward, as a ward login does."""
+        daily = self.daily.reset_index()
+        daily = daily[daily[TREND_DATE] != MISSING_KEY]
+        for col, value in (selections or {}).items():
+            if col in daily.columns:
+                daily = daily[daily[col] == value]
+        by_day = daily.groupby(TREND_DATE)[TREND_MEASURES].sum().sort_index()
+        for measure, ward_measure in WARD_TREND_MEASURES.items():
+            if ward_scope:
+                by_day[measure] = by_day[ward_measure]
+            by_day = by_day.drop(columns=ward_measure)
+        by_day["Cumulative Approved"] = by_day["Approved Records"].cumsum()
+        by_day["Cumulative Flagged"] = by_day["Flagged Records"].cumsum()
+        by_day["Cumulative Error Rate %"] = (
+            by_day["Cumulative Flagged"] / by_day["Cumulative Approved"].where(by_day["Cumulative Approved"] > 0) * 100
+        ).fillna(0).round(1)
+        return by_day
+
+
+# ---------------- WARD-PARTITIONED EXECUTION ----------------
+_POOL = None
+_POOL_LOCK = threading.Lock()
+
+
+def _process_pool():
+    """The process-wide worker pool, started on first use (spawned, so it is safe from the refresher thread)."""
+    global _POOL
+    with _POOL_LOCK:
+        if _POOL is None:
+            _POOL = ProcessPoolExecutor(max_workers=QC_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return _POOL
+
+
+def ward_partitions(df_mortality, df_females, df_preg_history, columns):
+    """Split the tables into per-ward (mortality, female, pregnancy) parts holding only the columns QC reads.
+
+    Female/pregnancy rows follow their submission's ward; rows without a known ward form one more part.
+    """
+    mortality_cols = ['_uuid', VALIDATION_COL] + [
+        columns[name] for name in ('unique_code_col', 'ra_col') + NEAR_DUPLICATE_BLOCK
+    ]
+    female_cols = ['_submission__uuid'] + [columns[key] for key in QC_FIELDS["female"].values()]
+    preg_cols = ['_submission__uuid'] + [columns[key] for key in QC_FIELDS["pregnancy"].values()]
+
+    def pruned(df, cols):
+        return df[[col for col in dict.fromkeys(cols) if col in df.columns]]
+
+    ward_col = columns['ward_col']
+    if ward_col and ward_col in df_mortality.columns:
+        wards = _keys(df_mortality[ward_col])
+    else:
+        wards = pd.Series(MISSING_KEY, index=df_mortality.index)
+    ward_of_submission = dict(zip(df_mortality['_uuid'], wards))
+
+    def rows_by_ward(df, ward_keys):
+        return pd.Series(ward_keys.to_numpy()).groupby(ward_keys.to_numpy()).indices if len(df) else {}
+
+    mortality_rows = rows_by_ward(df_mortality, wards)
+    female_rows = rows_by_ward(
+        df_females, df_females['_submission__uuid'].map(ward_of_submission).fillna(MISSING_KEY)
+    )
+    preg_rows = rows_by_ward(
+        df_preg_history, df_preg_history['_submission__uuid'].map(ward_of_submission).fillna(MISSING_KEY)
+    )
+    no_rows = np.array([], dtype=np.intp)
+    for ward in dict.fromkeys([*mortality_rows, *female_rows, *preg_rows]):
+        yield (
+            pruned(df_mortality, mortality_cols).iloc[mortality_rows.get(ward, no_rows)],
+            pruned(df_females, female_cols).iloc[female_rows.get(ward, no_rows)],
+            pruned(df_preg_history, preg_cols).iloc[preg_rows.get(ward, no_rows)],
+        )
+
+
+def ward_local_qc(df_mortality, df_females, df_preg_history, columns, female_index=None):
+    """The checks that never look outside a ward: consistency flags and near-duplicate households."""
+    checks = submission_checks(df_mortality, df_females, df_preg_history, columns)
+    near_duplicates = NearDuplicateIndex.from_records(
+        near_duplicate_records(df_mortality, df_females, columns, female_index)
+    )
+    return checks, near_duplicates
+
+
+def parallel_ward_local_qc(df_mortality, df_females, df_preg_history, columns, female_index=None):
+    """ward_local_qc() with one task per ward on the process pool, merged back into whole-export results.
+
+    Ward partitions are sliced out of the sheets, so `female_index` (whole-sheet positions) only serves
+    the serial fallback.
+    """
+    parts = list(ward_partitions(df_mortality, df_females, df_preg_history, columns))
+    try:
+        results = list(_process_pool().map(ward_local_qc, *zip(*parts), [columns] * len(parts)))
+    except (BrokenProcessPool, OSError) as e:
+        logger.warning("QC process pool unavailable, running serially: %s", e)
+        return ward_local_qc(df_mortality, df_females, df_preg_history, columns, female_index)
+    checks = pd.concat([part_checks for part_checks, _ in results])
+    return checks, NearDuplicateIndex.merged(near for _, near in results)
+
+
+# ---------------- QC STATE ----------------
+class QCState:
+    """QC results for one data version, kept per submission so the next version can be derived from the delta.
+
+    - `checks`: consistency flags, Research_Assistant and ward per submission UUID
+    - `duplicate_indexes`: a DuplicateIndex per duplicate check (Approved/On Hold rows only)
+    - `near_duplicates`: a NearDuplicateIndex of households (Approved/On Hold rows only)
+
+    `updated()` recomputes consistency checks only for the changed submissions and re-indexes
+    only the keys those submissions had or now have.
+    """
+
+    def __init__(self, columns, checks, duplicate_indexes, near_duplicates):
+        self.columns = columns
+        self.checks = checks
+        self.duplicate_indexes = duplicate_indexes
+        self.near_duplicates = near_duplicates
+
+    @classmethod
+    def build(cls, df_mortality, df_females, df_preg_history, child_rows=None):
+        """QC state computed from scratch; `child_rows` is the optional (female, pregnancy history) ChildIndex."""
+        female_index = child_rows[0] if child_rows is not None else None
+        df_mortality = _ensure_columns(df_mortality, '_uuid')
+        df_females = _ensure_columns(df_females, '_submission__uuid')
+        df_preg_history = _ensure_columns(df_preg_history, '_submission__uuid')
+        columns = resolve_qc_columns(df_mortality, df_females, df_preg_history)
+        if QC_WORKERS > 1 and len(df_mortality) >= PARALLEL_MIN_SUBMISSIONS:
+            checks, near_duplicates = parallel_ward_local_qc(
+                df_mortality, df_females, df_preg_history, columns, female_index
+            )
+        else:
+            checks, near_duplicates = ward_local_qc(df_mortality, df_females, df_preg_history, columns, female_index)
+        checks = checks.sort_index()
+        # Merge step: exact duplicates are global (they cross wards), so they are indexed over the whole export
+        duplicate_indexes = build_duplicate_indexes(df_mortality, df_females, df_preg_history)
+        return cls(columns, checks, duplicate_indexes, near_duplicates)
+
+    def updated(self, df_mortality, df_females, df_preg_history, changed_uuids, child_rows=None):
+        """New state for the next data version, where only `changed_uuids` were added, edited, re-validated or removed.
+
+        `child_rows` is an optional (female, pregnancy history) ChildIndex over these frames, used to gather the
+        changed submissions' child rows instead of scanning both sheets.
+        """
+        df_mortality = _ensure_columns(df_mortality, '_uuid')
+        df_females = _ensure_columns(df_females, '_submission__uuid')
+        df_preg_history = _ensure_columns(df_preg_history, '_submission__uuid')
+        columns = resolve_qc_columns(df_mortality, df_females, df_preg_history)
+        if columns != self.columns:
+            return QCState.build(df_mortality, df_females, df_preg_history, child_rows)
+
+        changed = pd.Index(list(changed_uuids))
+        changed_mortality = df_mortality[df_mortality['_uuid'].isin(changed)]
+        if child_rows is not None:
+            female_index, preg_index = child_rows
+            changed_females = df_females.iloc[female_index.rows(changed)]
+            changed_preg = df_preg_history.iloc[preg_index.rows(changed)]
+        else:
+            changed_females = df_females[df_females['_submission__uuid'].isin(changed)]
+            changed_preg = df_preg_history[df_preg_history['_submission__uuid'].isin(changed)]
+
+        checks = pd.concat([
+            self.checks[~self.checks.index.isin(changed)],
+            submission_checks(changed_mortality, changed_females, changed_preg, columns),
+        ]).sort_index()
+
+        new_rows = duplicate_key_rows(changed_mortality, changed_females, changed_preg, columns)
+        duplicate_indexes = {
+            flag: index.updated(changed, new_rows[flag]) for flag, index in self.duplicate_indexes.items()
+        }
+        if child_rows is not None:
+            near_records = near_duplicate_records(changed_mortality, df_females, columns, child_rows[0])
+        else:
+            near_records = near_duplicate_records(changed_mortality, changed_females, columns)
+        near_duplicates = self.near_duplicates.updated(changed, near_records)
+        return QCState(columns, checks, duplicate_indexes, near_duplicates)
+
+    def ward_table(self):
+        """table() rows for every submission with duplicates checked within its own ward, as each ward login sees them."""
+        wards = self.checks["_ward"].unique()
+        if not len(wards):
+            return self.table()
+        return pd.concat([self.table(ward) for ward in wards], ignore_index=True)
+
+    def table(self, ward=ALL_WARDS):
+        """QC dataframe (same columns as generate_qc_dataframe) for all wards, or duplicates checked within one ward."""
+        checks = self.checks if ward is ALL_WARDS else self.checks[self.checks["_ward"] == ward]
+        qc_df = pd.DataFrame({"_submission__uuid": checks.index})
+        for flag, rule in QC_RULES.items():
+            if flag not in ACTIVE_RULES:
+                qc_df[flag] = False
+            elif rule["kind"] == "consistency":
+                qc_df[flag] = checks[flag].to_numpy(dtype=bool)
+            elif rule["kind"] == "duplicate":
+                # Duplication Errors (now ONLY includes Approved/On Hold duplicates)
+                duplicates = self.duplicate_indexes[flag].duplicate_submissions(ward)
+                qc_df[flag] = qc_df["_submission__uuid"].isin(list(duplicates))
+            else:
+                # Blocks include the ward, so near-duplicates never cross a ward boundary
+                qc_df[flag] = qc_df["_submission__uuid"].isin(list(self.near_duplicates.flagged()))
+
+        flags = qc_df[list(QC_FLAGS)].to_numpy()
+        qc_df["QC_Flags"] = (flags.astype(np.int64) << np.arange(len(QC_FLAGS))).sum(axis=1)
+        qc_df["Total_Flags"] = flags.sum(axis=1)
+        qc_df["Research_Assistant"] = checks["Research_Assistant"].to_numpy()
+        qc_df["Error_Percentage"] = (qc_df["Total_Flags"] / len(ACTIVE_RULES)) * 100
+        return qc_df
+
+
+def generate_qc_dataframe(df_mortality, df_females, df_preg_history):
+    """
+    Generate QC dataframe with error detection.
+    CRITICAL: Duplicate household detection now ONLY considers records that are 'Approved' or 'On Hold',
+    excluding 'Not Approved' records entirely from duplication logic.
+    """
+    return QCState.build(df_mortality, df_females, df_preg_history).table()